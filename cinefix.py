@@ -20,9 +20,22 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import hashlib
+import io
+import json
+import mmap
+import os
+import sqlite3
 import sys
+import time
+import zlib
 from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor, wait
 from fractions import Fraction
+from functools import lru_cache
+from multiprocessing import Manager
+import numpy
 from numpy import float32
 
 VERSION_STRING="0.01"
@@ -30,9 +43,15 @@ VERSION_STRING="0.01"
 def getInt(f):
 	return int.from_bytes(f.read(4), byteorder='big')
 
+def getInt64(f):
+	return int.from_bytes(f.read(8), byteorder='big')
+
 def uintBytes(i):
 	return i.to_bytes(4, byteorder='big', signed=False)
 
+def uint64Bytes(i):
+	return i.to_bytes(8, byteorder='big', signed=False)
+
 def uint16Bytes(i):
 	return i.to_bytes(2, byteorder='big', signed=False)
 
@@ -72,12 +91,6 @@ class SampleRec:
 		f.write(uintBytes(self.time | self.shadowSyncSample << 31))
 		f.write(uintBytes(self.duration))
 
-	def isAudio(self):
-		if self.type == 'Audio':
-			return True
-		else:
-			return False
-
 class SampleTable:
 	def calcValues(self):
 		self.timeUnit = 1.0 / float(self.timescale)
@@ -295,19 +308,26 @@ class FrameDescription:
 		f.write(uintBytes(self.height))
 		f.write(uintBytes(self.width))
 
+# The Jaguar video clocks, in Hz, that the audio sample rate is derived from
+JAG_NTSC_VIDEO_CLOCK = 26590906
+JAG_PAL_VIDEO_CLOCK = 26593900
+
 class AudioDescription:
-	def calcValues(self):
-		# This is the NTSC video clock, in Hz.  The PAL one is 26593900.
-		# Which is correct when value is baked into a region-agnostic file???
-		jagVidClock = 26590906
+	def calcValues(self, videoClock=None):
+		# The NTSC video clock is used unless another one is given.  Which
+		# is correct when value is baked into a region-agnostic file???
+		if videoClock != None:
+			self.videoClock = videoClock
 
 		# jagSampleRate = (jagVidClock / (2 * (sclk + 1))) / 32
-		jagSampleRate = Fraction(jagVidClock, (2 * (self.sclk + 1)) * 32)
+		jagSampleRate = Fraction(self.videoClock, (2 * (self.sclk + 1)) * 32)
 
 		# sampleRate = jagSampleRate + (jagSampleRate / (2^32 / driftRate))
 		self.sampleRate = float(jagSampleRate + Fraction(jagSampleRate, Fraction(0xFFFFFFFF, self.driftRate)))
 
-	def __init__(self, channels=1, bits=8, compression="uncompressed", signed=0, sclk=0x18, driftRate=0x481db08, f=None):
+	def __init__(self, channels=1, bits=8, compression="uncompressed", signed=0, sclk=0x18, driftRate=0x481db08, videoClock=JAG_NTSC_VIDEO_CLOCK, f=None):
+		self.videoClock = videoClock
+
 		if f != None:
 			self.read(f)
 		else:
@@ -359,6 +379,27 @@ class AudioDescription:
 
 		self.calcValues()
 
+	def getChannelCount(self):
+		# channels holds the stereo flag of the audio description
+		if self.channels:
+			return 2
+		else:
+			return 1
+
+	def getBytesPerSecond(self):
+		return self.sampleRate * self.getChannelCount() * (self.bits // 8)
+
+	def getFrameSize(self):
+		return self.getChannelCount() * (self.bits // 8)
+
+	def getSilence(self, size):
+		if self.signed:
+			return bytes(size)
+		elif self.bits == 16:
+			return b'\x80\x00' * (size // 2)
+		else:
+			return b'\x80' * size
+
 	def getSize(self):
 		return 20
 
@@ -379,10 +420,14 @@ class AudioDescription:
 		f.write(uintBytes(self.driftRate))
 
 class Film(SampleContainer):
-	def __init__(self, frameDesc=None, audioDesc=None, chunkTable=None, sampleTable=None, f=None):
+	def __init__(self, frameDesc=None, audioDesc=None, chunkTable=None, sampleTable=None, f=None, headerOnly=False):
 		if f != None:
 			self._readHeader(f)
-			if self.type == 'Smooth':
+			if headerOnly:
+				# Leave the tables for the caller to deal with
+				SampleContainer.__init__(self, sampleTable=None)
+				self.chunkTable = None
+			elif self.type == 'Smooth':
 				SampleContainer.__init__(self, f=f)
 				self.chunkTable = None
 			elif self.type == 'Chunky':
@@ -395,6 +440,10 @@ class Film(SampleContainer):
 			self.frameDesc = frameDesc
 			self.audioDesc = audioDesc
 			self.chunkTable = chunkTable
+			if chunkTable != None:
+				self.type = 'Chunky'
+			else:
+				self.type = 'Smooth'
 			SampleContainer.__init__(self, sampleTable=sampleTable)
 
 	def _readHeader(self, f):
@@ -405,7 +454,7 @@ class Film(SampleContainer):
 			print("Film header not found")
 			sys.exit(1)
 
-		hdrSize = getInt(f)
+		self.headerSize = getInt(f)
 		# Skip over version and reserved fields
 		f.seek(8, 1) # 8 bytes from SEEK_CUR
 
@@ -512,7 +561,7 @@ class SampleIterator:
 	def __iter__(self):
 		self.currentChunkIndex = 0
 		self.currentSampleIndex = 0
-		self.currentChunk = film.getChunk(self.f, self.currentChunkIndex)
+		self.currentChunk = self.film.getChunk(self.f, self.currentChunkIndex)
 
 		# Don't bother handling non-existant corner case of empty chunk
 
@@ -531,9 +580,9 @@ class SampleIterator:
 			if self.currentSampleIndex >= len(self.currentChunk.sampleTable.sampleRecords):
 				self.currentSampleIndex = 0
 				self.currentChunkIndex += 1
-				self.currentChunk = film.getChunk(self.f, self.currentChunkIndex)
+				self.currentChunk = self.film.getChunk(self.f, self.currentChunkIndex)
 		else:
-			s = film.getSample(self.f, self.currentSampleIndex, self.readSampleData)
+			s = self.film.getSample(self.f, self.currentSampleIndex, self.readSampleData)
 
 			if s == None:
 				raise StopIteration
@@ -560,23 +609,791 @@ class SampleIterator:
 		else:
 			return self.currentSampleIndex - 1
 
-class AudioSampleIterator(SampleIterator):
-	def __next__(self):
-		s = SampleIterator.__next__(self)
+def readSampleRecordArray(f, count):
+	# Reads count sample records in one go, returning them as rows of
+	# (start, size, time, duration) in a count x 4 array.
+	return numpy.frombuffer(f.read(count * 16), dtype='>u4').reshape(count, 4).astype(numpy.int64)
+
+class SampleIndex:
+	# The sample records of a whole film in stream order, kept as arrays so
+	# they can be searched and summed without reading any sample data.
+	# offsets are absolute file offsets of the sample data, and chunks are
+	# the index of the chunk each sample is stored in, or -1 in Smooth
+	# films.  fileIds say which of several files each sample is read from,
+	# with -1 marking generated audio silence.  Indexes can also be read
+	# for a single chunk, or joined together from other indexes.
+	ARRAYS = ('offsets', 'sizes', 'times', 'syncs', 'durations', 'chunks', 'fileIds')
 
-		while s.record.type != 'Audio':
-			s = SampleIterator.__next__(self)
+	def calcValues(self):
+		self.audio = self.times == 0x7FFFFFFF
 
-		return s
+		# Stream positions of the video samples, and the time each of them
+		# ends at, so the frame showing at a time is a binary search away.
+		self.videoPositions = numpy.flatnonzero(~self.audio)
+		self.videoEnds = numpy.cumsum(self.durations[self.videoPositions])
 
-class VideoSampleIterator(SampleIterator):
-	def __next__(self):
-		s = SampleIterator.__next__(self)
+	def __init__(self, offsets=None, sizes=None, times=None, syncs=None, durations=None, chunks=None, fileIds=None, indexes=None, chunkIndex=None, film=None, f=None):
+		if f != None:
+			if chunkIndex != None:
+				self.readChunk(film, f, chunkIndex)
+			else:
+				self.read(film, f)
+		elif indexes != None:
+			self._join(indexes)
+		else:
+			self.offsets = offsets
+			self.sizes = sizes
+			self.times = times
+			self.syncs = syncs
+			self.durations = durations
+			self.chunks = chunks
+			if fileIds is not None:
+				self.fileIds = fileIds
+			else:
+				self.fileIds = numpy.zeros(len(sizes), dtype=numpy.int64)
+			self.calcValues()
+
+	def _join(self, indexes):
+		for name in self.ARRAYS:
+			if len(indexes) > 0:
+				setattr(self, name, numpy.concatenate([getattr(index, name) for index in indexes]))
+			else:
+				setattr(self, name, numpy.zeros(0, dtype=numpy.int64))
 
-		while s.record.type != 'Video':
-			s = SampleIterator.__next__(self)
+		self.calcValues()
 
-		return s
+	def _setRecords(self, records, offsets, chunks):
+		self.offsets = offsets
+		self.sizes = records[:, 1]
+		self.times = records[:, 2] & 0x7FFFFFFF
+		self.syncs = records[:, 2] >> 31
+		self.durations = records[:, 3]
+		self.chunks = chunks
+		self.fileIds = numpy.zeros(len(records), dtype=numpy.int64)
+		self.calcValues()
+
+	def _readChunkRecords(self, f, cRec):
+		sync = numpy.frombuffer(f.read(64), dtype='>u4')
+		if (sync != cRec.syncPattern).any():
+			print("WARNING: Invalid sync data in chunk!")
+
+		hdr = f.read(4)
+
+		if b'STAB' != hdr:
+			print("Sample table header not found")
+			sys.exit(1)
+
+		hdrSize = getInt(f)
+		timescale = getInt(f)
+		count = getInt(f)
+
+		if hdrSize != 16 + (16 * count):
+			print("WARNING: Invalid sample header size detected!")
+
+		return readSampleRecordArray(f, count)
+
+	def readChunk(self, film, f, cNum):
+		cRec = film.chunkTable.chunkRecords[cNum]
+		cOffset = film.getDataOffset() + cRec.start
+		f.seek(cOffset, 0) # Seek cOffset bytes from SEEK_SET
+
+		records = self._readChunkRecords(f, cRec)
+		dataOffset = cOffset + 64 + 16 + len(records) * 16
+
+		self._setRecords(records, records[:, 0] + dataOffset, numpy.full(len(records), cNum, dtype=numpy.int64))
+
+	def read(self, film, f):
+		if film.isChunky():
+			self._join([SampleIndex(film=film, f=f, chunkIndex=cNum) for cNum in range(len(film.chunkTable.chunkRecords))])
+		else:
+			sRecs = film.sampleTable.sampleRecords
+			records = numpy.array([(sRec.start, sRec.size, sRec.time | sRec.shadowSyncSample << 31, sRec.duration) for sRec in sRecs], dtype=numpy.int64).reshape(len(sRecs), 4)
+			self._setRecords(records, records[:, 0] + film.getDataOffset(), numpy.full(len(sRecs), -1, dtype=numpy.int64))
+
+	def subset(self, positions):
+		# Returns a new index of the samples at the given positions
+		index = SampleIndex(indexes=[])
+		for name in self.ARRAYS:
+			setattr(index, name, getattr(self, name)[positions])
+		index.calcValues()
+
+		return index
+
+	def __len__(self):
+		return len(self.sizes)
+
+	def findVideoSample(self, time):
+		# Returns the index position of the video sample showing at time,
+		# in timescale units, or None if time is past the end of the film.
+		frame = numpy.searchsorted(self.videoEnds, time, side='right')
+
+		if time < 0 or frame >= len(self.videoPositions):
+			return None
+
+		return int(self.videoPositions[frame])
+
+	def getRecord(self, i):
+		return SampleRec(start=int(self.offsets[i]), size=int(self.sizes[i]), time=int(self.times[i]), shadowSyncSample=int(self.syncs[i]), duration=int(self.durations[i]))
+
+	def getSample(self, f, i, readData=False):
+		sRec = self.getRecord(i)
+		data = None
+
+		if readData:
+			# Seek from SEEK_SET to the offset of the sample
+			f.seek(sRec.start, 0)
+			data = f.read(sRec.size)
+
+		return Sample(sRec, data)
+
+class ChunkCache:
+	# Reads the sample records of a Chunky film a chunk at a time, as they
+	# are needed, keeping the most recently used chunks parsed.  The number
+	# of audio bytes before each chunk read so far is also kept, so audio
+	# can be placed on the timeline without parsing those chunks again.
+	def __init__(self, film, f, size=256):
+		self.film = film
+		self.file = f
+		self.audioBytesBefore = [0]
+		self.getChunkIndex = lru_cache(maxsize=size)(self._readChunkIndex)
+
+	def _readChunkIndex(self, cNum):
+		return SampleIndex(film=self.film, f=self.file, chunkIndex=cNum)
+
+	def getChunkCount(self):
+		return len(self.film.chunkTable.chunkRecords)
+
+	def getAudioBytesBefore(self, cNum):
+		while len(self.audioBytesBefore) <= cNum:
+			index = self.getChunkIndex(len(self.audioBytesBefore) - 1)
+			self.audioBytesBefore.append(self.audioBytesBefore[-1] + int(index.sizes[index.audio].sum()))
+
+		return self.audioBytesBefore[cNum]
+
+	def getFrameTimes(self, cNum):
+		# The video time of each sample in a chunk, counted from the chunk
+		# time in the chunk table.
+		index = self.getChunkIndex(cNum)
+		durations = numpy.where(index.audio, 0, index.durations)
+
+		return self.film.chunkTable.chunkRecords[cNum].time + numpy.cumsum(durations) - durations
+
+def getClipIndex(film, cache, startTime, endTime):
+	# Builds an index of the samples needed to play a film from startTime
+	# to endTime, in timescale units.  Video starts at the last sync frame
+	# at or before startTime, and the audio covering the same stretch of
+	# time is trimmed to match where the audio format allows it.
+	chunkTimes = numpy.array([cRec.time for cRec in film.chunkTable.chunkRecords], dtype=numpy.int64)
+	firstChunk = max(int(numpy.searchsorted(chunkTimes, startTime, side='right')) - 1, 0)
+
+	startChunk = None
+	cNum = firstChunk
+	while cNum >= 0 and startChunk == None:
+		index = cache.getChunkIndex(cNum)
+		frameTimes = cache.getFrameTimes(cNum)
+		syncFrames = numpy.flatnonzero(~index.audio & (index.syncs != 0) & (frameTimes <= startTime))
+
+		if len(syncFrames) > 0:
+			startChunk = cNum
+			clipStart = int(frameTimes[syncFrames[-1]])
+
+		cNum -= 1
+
+	if startChunk == None:
+		print("WARNING: No sync frame found before the start of the clip")
+		startChunk = firstChunk
+		clipStart = startTime
+
+	videoIndexes = []
+	cNum = startChunk
+	while cNum < cache.getChunkCount() and chunkTimes[cNum] < endTime:
+		index = cache.getChunkIndex(cNum)
+		frameTimes = cache.getFrameTimes(cNum)
+		videoIndexes.append(index.subset(numpy.flatnonzero(~index.audio & (frameTimes >= clipStart) & (frameTimes < endTime))))
+		cNum += 1
+
+	videoIndex = SampleIndex(indexes=videoIndexes)
+	clipEnd = clipStart + int(videoIndex.durations.sum())
+
+	# Find the audio covering the same time, in bytes along the audio
+	# stream, rounded to whole sample frames.
+	audioDesc = film.audioDesc
+	frameSize = audioDesc.getFrameSize()
+	timescale = float(film.getTimescale())
+	audioStart = int(clipStart / timescale * audioDesc.getBytesPerSecond()) // frameSize * frameSize
+	audioEnd = int(clipEnd / timescale * audioDesc.getBytesPerSecond()) // frameSize * frameSize
+	trimAudio = audioDesc.compression == "uncompressed"
+
+	cNum = 0
+	while cNum < cache.getChunkCount() and cache.getAudioBytesBefore(cNum + 1) <= audioStart:
+		cNum += 1
+
+	audioIndexes = []
+	while cNum < cache.getChunkCount() and cache.getAudioBytesBefore(cNum) < audioEnd:
+		index = cache.getChunkIndex(cNum)
+		audio = index.subset(numpy.flatnonzero(index.audio))
+		starts = cache.getAudioBytesBefore(cNum) + numpy.cumsum(audio.sizes) - audio.sizes
+		ends = starts + audio.sizes
+		audio = audio.subset(numpy.flatnonzero((ends > audioStart) & (starts < audioEnd)))
+		starts = starts[(ends > audioStart) & (starts < audioEnd)]
+
+		if trimAudio and len(audio) > 0:
+			skip = numpy.maximum(audioStart - starts, 0)
+			cut = numpy.maximum(starts + audio.sizes - audioEnd, 0)
+			audio.offsets = audio.offsets + skip
+			audio.sizes = audio.sizes - skip - cut
+
+		audioIndexes.append(audio)
+		cNum += 1
+
+	# The interleave only looks at the order of samples of the same type
+	return SampleIndex(indexes=audioIndexes + [videoIndex])
+
+def getDropIndex(film, index, windows=None):
+	# Drops the video frames that are not sync frames, either everywhere or
+	# only in the given (start, end) windows, in timescale units.  Each
+	# frame kept stays on screen for the frames dropped after it, so the
+	# timeline and the audio are unchanged.
+	#
+	# Cinepak frames that are not sync frames are decoded on top of the
+	# frame before them, so once a frame has been dropped, every frame up
+	# to the next sync frame has to go too.  Windows are therefore
+	# stretched to end at the first sync frame at or after their end.
+	video = numpy.flatnonzero(~index.audio)
+	durations = index.durations[video]
+	syncs = index.syncs[video] != 0
+	frameTimes = numpy.cumsum(durations) - durations
+
+	if windows == None:
+		dropped = ~syncs
+	else:
+		inWindow = numpy.zeros(len(video), dtype=bool)
+		syncFrames = numpy.flatnonzero(syncs)
+
+		for (startTime, endTime) in windows:
+			first = int(numpy.searchsorted(frameTimes, startTime, side='left'))
+			last = int(numpy.searchsorted(frameTimes, endTime, side='left'))
+			nextSync = numpy.searchsorted(syncFrames, last, side='left')
+			if nextSync < len(syncFrames):
+				last = int(syncFrames[nextSync])
+			else:
+				last = len(video)
+			inWindow[first:last] = True
+
+		dropped = inWindow & ~syncs
+
+	kept = numpy.flatnonzero(~dropped)
+	if len(kept) == 0:
+		return index.subset(numpy.flatnonzero(index.audio))
+
+	# Give each dropped frame's time to the last frame kept before it, or to
+	# the first frame kept if there is none.
+	owners = numpy.maximum(numpy.searchsorted(kept, numpy.arange(len(video)), side='right') - 1, 0)
+	keptDurations = numpy.bincount(owners, weights=durations, minlength=len(kept)).astype(numpy.int64)
+
+	keep = numpy.ones(len(index), dtype=bool)
+	keep[video[dropped]] = False
+	dropIndex = index.subset(numpy.flatnonzero(keep))
+	dropIndex.durations[~dropIndex.audio] = keptDurations
+	dropIndex.calcValues()
+
+	return dropIndex
+
+def getChunkRates(chunkTable):
+	# Returns the data rate of each chunk but the last in bytes per second
+	# of video, or 0 for chunks without any video.
+	times = numpy.array([cRec.time for cRec in chunkTable.chunkRecords], dtype=numpy.int64)
+	sizes = numpy.array([cRec.size for cRec in chunkTable.chunkRecords], dtype=numpy.int64)
+	durations = numpy.diff(times) / float(chunkTable.timescale)
+
+	return numpy.where(durations > 0, sizes[:-1] / numpy.maximum(durations, 1e-9), 0)
+
+class SeekIndex:
+	# One entry per sync frame of a film, holding the frame time, the index
+	# of the chunk it is in, the offset of that chunk from the start of the
+	# film, and the index of the frame in the chunk's sample table.  A
+	# player can start decoding at the last sync frame before any time.
+	def __init__(self, timescale=None, entries=None, f=None):
+		if f != None:
+			self.read(f)
+		else:
+			self.timescale = timescale
+			self.entries = entries
+
+	def read(self, f):
+		hdr = f.read(4)
+
+		if b'SIDX' != hdr:
+			print("Seek index header not found")
+			sys.exit(1)
+
+		size = getInt(f)
+		self.timescale = getInt(f)
+		count = getInt(f)
+
+		if size != 16 + (16 * count):
+			print("WARNING: Invalid seek index size detected!")
+
+		self.entries = readSampleRecordArray(f, count)
+
+	def getSize(self):
+		return 16 + len(self.entries) * 16
+
+	def write(self, f):
+		f.write(b'SIDX')
+		f.write(uintBytes(self.getSize()))
+		f.write(uintBytes(self.timescale))
+		f.write(uintBytes(len(self.entries)))
+		f.write(self.entries.astype('>u4').tobytes())
+
+	def find(self, time):
+		# Returns (time, chunk, chunk offset, sample index) of the last sync
+		# frame at or before time, in timescale units, or None if there is
+		# no such frame.
+		entry = numpy.searchsorted(self.entries[:, 0], time, side='right') - 1
+
+		if entry < 0:
+			return None
+
+		return tuple([int(v) for v in self.entries[entry]])
+
+def getSeekEntries(index, film):
+	# Builds seek index entries from the sample index of a Chunky film
+	video = ~index.audio
+	durations = numpy.where(video, index.durations, 0)
+	times = numpy.cumsum(durations) - durations
+
+	# Index of each sample in its chunk's sample table
+	firstSamples = numpy.searchsorted(index.chunks, index.chunks, side='left')
+	sampleIndices = numpy.arange(len(index)) - firstSamples
+
+	chunkOffsets = numpy.array([film.getDataOffset() + cRec.start for cRec in film.chunkTable.chunkRecords], dtype=numpy.int64)
+
+	sync = numpy.flatnonzero(video & (index.syncs != 0))
+
+	return numpy.stack((times[sync], index.chunks[sync], chunkOffsets[index.chunks[sync]], sampleIndices[sync]), axis=1)
+
+# Raw CD-DA sectors, which the Jaguar CD reads the data session as
+CD_SECTOR_SIZE = 2352
+CD_SECTORS_PER_SECOND = 75
+CD_BYTES_PER_SECOND = CD_SECTOR_SIZE * CD_SECTORS_PER_SECOND
+
+class ChunkPolicy:
+	# Controls where the fixed chunk table is cut.  Chunks are cut once they
+	# hold chunkDuration worth of video, and before they would grow past
+	# the chunk size limit.  The limit is maxChunkSize if given, further
+	# capped to the bytes a cdSpeed (1x/2x) drive reads in chunkDuration
+	# when a drive speed is given.
+	def __init__(self, chunkDuration=None, maxChunkSize=None, cdSpeed=None):
+		self.chunkDuration = chunkDuration
+		self.maxChunkSize = maxChunkSize
+		self.cdSpeed = cdSpeed
+
+	def getChunkDuration(self, film):
+		if self.chunkDuration != None:
+			return self.chunkDuration
+
+		if film.isChunky() and len(film.chunkTable.chunkRecords) > 1:
+			return film.chunkTable.chunkRecords[1].time - film.chunkTable.chunkRecords[0].time
+
+		# One-chunk and Smooth films have no chunk duration to copy, so
+		# use one second.
+		return film.getTimescale()
+
+	def getMaxRate(self):
+		if self.cdSpeed == None:
+			return None
+
+		return self.cdSpeed * CD_BYTES_PER_SECOND
+
+	def getMaxChunkSize(self, chunkDuration, timescale):
+		maxChunkSize = self.maxChunkSize
+
+		if self.cdSpeed != None:
+			rateLimit = (self.getMaxRate() * chunkDuration) // timescale
+			if maxChunkSize == None or rateLimit < maxChunkSize:
+				maxChunkSize = rateLimit
+
+		return maxChunkSize
+
+class PlaybackReport:
+	def __init__(self, startTime, minAudioLevel, minAudioLevelTime, audioUnderruns, lateFrames, stalls, headroom, headroomTime):
+		self.startTime = startTime
+		self.minAudioLevel = minAudioLevel
+		self.minAudioLevelTime = minAudioLevelTime
+		self.audioUnderruns = audioUnderruns
+		self.lateFrames = lateFrames
+		self.stalls = stalls
+		self.headroom = headroom
+		self.headroomTime = headroomTime
+
+	def isPlayable(self):
+		return len(self.audioUnderruns) == 0 and len(self.lateFrames) == 0
+
+	def _printTimes(self, times):
+		shown = ", ".join(["{:.2f}s".format(t) for t in times[:8]])
+		if len(times) > 8:
+			shown += ", ..."
+		print("    " + shown)
+
+	def printReport(self):
+		print("Playback starts after: {:.3f}s".format(self.startTime))
+		if self.minAudioLevel != None:
+			print("Minimum audio buffer level: {:.3f}s at {:.2f}s".format(self.minAudioLevel, self.minAudioLevelTime))
+		print("Seek-free headroom: {:.3f}s at {:.2f}s".format(self.headroom, self.headroomTime))
+
+		if len(self.audioUnderruns) > 0:
+			print("WARNING: Audio buffer underruns at " + str(len(self.audioUnderruns)) + " points:")
+			self._printTimes(self.audioUnderruns)
+
+		if len(self.lateFrames) > 0:
+			print("WARNING: " + str(len(self.lateFrames)) + " video frames arrive late:")
+			self._printTimes(self.lateFrames)
+
+		if len(self.stalls) > 0:
+			print(str(len(self.stalls)) + " reads stall waiting for buffer space:")
+			self._printTimes(self.stalls)
+
+class PlaybackSimulator:
+	# Replays the stream of a film against a simple model of the player.
+	# The drive reads the film sequentially at a constant rate, and the
+	# player only uses a chunk once it has been read completely.  Playback
+	# starts once the first chunk is in, after which audio is consumed at
+	# the audio sample rate and each video frame is shown at its sample
+	# time.  If the audio or video buffers are given a size, the drive
+	# stops reading whenever the next chunk would not fit, which on the
+	# real hardware costs a seek to get back to where it left off.
+	#
+	# Times in the report are in seconds of playback, except startTime,
+	# which is the time from the start of the read to the start of playback.
+	def __init__(self, film, index, cdSpeed=2, audioBufferSize=None, videoBufferSize=None):
+		self.film = film
+		self.index = index
+		self.rate = float(cdSpeed * CD_BYTES_PER_SECOND)
+		self.audioBufferSize = audioBufferSize
+		self.videoBufferSize = videoBufferSize
+
+	def _getReadUnits(self):
+		# Chunky films are read a chunk at a time, Smooth films a sample at
+		# a time.
+		index = self.index
+
+		if self.film.isChunky():
+			unitSizes = numpy.array([cRec.size for cRec in self.film.chunkTable.chunkRecords], dtype=numpy.int64)
+			sampleUnits = index.chunks
+		else:
+			unitSizes = index.sizes.copy()
+			sampleUnits = numpy.arange(len(index), dtype=numpy.int64)
+
+		# The film header is read along with the first unit
+		if len(unitSizes) > 0:
+			unitSizes[0] += self.film.getDataOffset()
+
+		return (unitSizes, sampleUnits)
+
+	def _getReadyTimes(self, unitBytes, consumedBytes, consumeTimes, bufferSize):
+		# The time each unit fits in a buffer of bufferSize bytes, given the
+		# cumulative bytes put in the buffer up to and including each unit
+		# and the cumulative bytes consumed from it at consumeTimes.
+		needed = unitBytes - bufferSize
+		slot = numpy.searchsorted(consumedBytes, needed, side='left')
+		slot = numpy.minimum(slot, len(consumeTimes) - 1)
+
+		return numpy.where(needed > 0, consumeTimes[slot], 0.0)
+
+	def run(self):
+		index = self.index
+		timescale = float(self.film.getTimescale())
+		bytesPerSecond = self.film.audioDesc.getBytesPerSecond()
+		(unitSizes, sampleUnits) = self._getReadUnits()
+
+		audio = index.audio
+		video = ~audio
+		audioUnits = sampleUnits[audio]
+		videoUnits = sampleUnits[video]
+		audioSizes = index.sizes[audio]
+		videoSizes = index.sizes[video]
+
+		# When audio and video need to have been read by, relative to the
+		# start of playback
+		audioStarts = (numpy.cumsum(audioSizes) - audioSizes) / bytesPerSecond
+		videoDurations = index.durations[video]
+		videoStarts = (numpy.cumsum(videoDurations) - videoDurations) / timescale
+
+		# Time to read each unit with nothing else in the way
+		readTimes = numpy.cumsum(unitSizes) / self.rate
+		startTime = readTimes[0] if len(readTimes) > 0 else 0.0
+
+		# Times at which the buffers could take each unit, once enough has
+		# been consumed to make room for it
+		readyTimes = numpy.zeros(len(unitSizes))
+		if self.audioBufferSize != None and len(audioSizes) > 0:
+			unitAudio = numpy.cumsum(numpy.bincount(audioUnits, weights=audioSizes, minlength=len(unitSizes)))
+			consumed = numpy.cumsum(audioSizes) - audioSizes
+			readyTimes = numpy.maximum(readyTimes, self._getReadyTimes(unitAudio, consumed, startTime + audioStarts, self.audioBufferSize))
+		if self.videoBufferSize != None and len(videoSizes) > 0:
+			unitVideo = numpy.cumsum(numpy.bincount(videoUnits, weights=videoSizes, minlength=len(unitSizes)))
+			consumed = numpy.cumsum(videoSizes)
+			readyTimes = numpy.maximum(readyTimes, self._getReadyTimes(unitVideo, consumed, startTime + videoStarts + videoDurations / timescale, self.videoBufferSize))
+
+		# Nothing is consumed until the first unit is in
+		if len(readyTimes) > 0:
+			readyTimes[0] = 0.0
+
+		# Each unit is read once the previous one is done and there is room
+		# for it: done[c] = max(done[c - 1], ready[c]) + size[c] / rate,
+		# which unrolls to a running maximum.
+		prevReadTimes = numpy.concatenate(([0.0], readTimes[:-1]))
+		doneTimes = readTimes + numpy.maximum.accumulate(numpy.maximum(readyTimes - prevReadTimes, 0.0))
+		prevDoneTimes = numpy.concatenate(([0.0], doneTimes[:-1]))
+		stalls = numpy.flatnonzero(readyTimes > prevDoneTimes)
+
+		# How early each sample arrives before it is needed
+		audioSlack = startTime + audioStarts - doneTimes[audioUnits]
+		videoSlack = startTime + videoStarts - doneTimes[videoUnits]
+
+		# Samples in the first unit are in by definition when playback
+		# starts, so they are left out of the minimums.
+		laterAudio = audioUnits > 0
+		laterVideo = videoUnits > 0
+
+		if laterAudio.any():
+			minAudio = int(numpy.argmin(numpy.where(laterAudio, audioSlack, numpy.inf)))
+			minAudioLevel = float(audioSlack[minAudio])
+			minAudioLevelTime = float(audioStarts[minAudio])
+		else:
+			minAudioLevel = None
+			minAudioLevelTime = None
+
+		slack = numpy.concatenate((audioSlack[laterAudio], videoSlack[laterVideo]))
+		slackTimes = numpy.concatenate((audioStarts[laterAudio], videoStarts[laterVideo]))
+		if len(slack) > 0:
+			worst = int(numpy.argmin(slack))
+			headroom = float(slack[worst])
+			headroomTime = float(slackTimes[worst])
+		else:
+			headroom = 0.0
+			headroomTime = 0.0
+
+		return PlaybackReport(startTime=float(startTime),
+				      minAudioLevel=minAudioLevel,
+				      minAudioLevelTime=minAudioLevelTime,
+				      audioUnderruns=audioStarts[audioSlack < 0].tolist(),
+				      lateFrames=videoStarts[videoSlack < 0].tolist(),
+				      stalls=(prevDoneTimes[stalls] - startTime).tolist(),
+				      headroom=headroom,
+				      headroomTime=headroomTime)
+
+class ProgressBar:
+	def __init__(self, stream=None, width=30):
+		if stream != None:
+			self.stream = stream
+		else:
+			self.stream = sys.stderr
+		self.width = width
+
+	def __call__(self, progress, done):
+		rate = progress.getRate() / 1000000.0
+		eta = progress.getEta()
+
+		if progress.totalBytes:
+			fraction = min(float(progress.bytes) / progress.totalBytes, 1.0)
+			filled = int(fraction * self.width)
+			bar = '[' + '#' * filled + ' ' * (self.width - filled) + '] {:5.1f}%'.format(fraction * 100.0)
+		else:
+			bar = '{:.1f} MB'.format(progress.bytes / 1000000.0)
+
+		if eta != None:
+			etaStr = ' ETA {:d}:{:02d}:{:02d}'.format(int(eta) // 3600, (int(eta) // 60) % 60, int(eta) % 60)
+		else:
+			etaStr = ''
+
+		self.stream.write('\r' + progress.label + ' ' + bar + ' {:.1f} MB/s'.format(rate) + etaStr + '  ')
+
+		if done:
+			self.stream.write('\n')
+
+		self.stream.flush()
+
+class ProgressJsonStream:
+	def __init__(self, stream):
+		self.stream = stream
+
+	def __call__(self, progress, done):
+		status = {
+			'stage': progress.label,
+			'bytes': progress.bytes,
+			'totalBytes': progress.totalBytes,
+			'samples': progress.samples,
+			'totalSamples': progress.totalSamples,
+			'mbPerSec': round(progress.getRate() / 1000000.0, 3),
+			'eta': progress.getEta(),
+			'done': done,
+		}
+
+		self.stream.write(json.dumps(status) + '\n')
+		self.stream.flush()
+
+class ProgressQueueReporter:
+	# Forwards the progress of a worker process to the parent process, which
+	# sums the updates of all its workers.
+	def __init__(self, queue):
+		self.queue = queue
+		self.lastBytes = 0
+		self.lastSamples = 0
+
+	def __call__(self, progress, done):
+		self.queue.put((progress.bytes - self.lastBytes, progress.samples - self.lastSamples))
+		self.lastBytes = progress.bytes
+		self.lastSamples = progress.samples
+
+class Progress:
+	# Reporters are callables taking the Progress object and a flag that is
+	# set on the last report of each stage.  Library users can pass their
+	# own functions alongside or instead of the ones above.
+	#
+	# update() is called from the inner copy loops, so it only looks at the
+	# clock once every checkBytes bytes, and the reporters are only called
+	# once every interval seconds.
+	def __init__(self, reporters=None, interval=0.5, checkBytes=0x40000):
+		if reporters != None:
+			self.reporters = reporters
+		else:
+			self.reporters = []
+		self.interval = interval
+		self.checkBytes = checkBytes
+		self.start("")
+
+	def start(self, label, totalBytes=None, totalSamples=None):
+		self.label = label
+		self.totalBytes = totalBytes
+		self.totalSamples = totalSamples
+		self.bytes = 0
+		self.samples = 0
+		self.startTime = time.monotonic()
+		self.lastReportTime = self.startTime
+		self.nextCheck = self.checkBytes
+
+	def update(self, nBytes, nSamples=0):
+		self.bytes += nBytes
+		self.samples += nSamples
+
+		if self.bytes < self.nextCheck:
+			return
+
+		self.nextCheck = self.bytes + self.checkBytes
+		now = time.monotonic()
+
+		if now - self.lastReportTime >= self.interval:
+			self.lastReportTime = now
+			self._report(False)
+
+	def finish(self):
+		self._report(True)
+
+	def _report(self, done):
+		for reporter in self.reporters:
+			reporter(self, done)
+
+	def getElapsed(self):
+		return time.monotonic() - self.startTime
+
+	def getRate(self):
+		elapsed = self.getElapsed()
+
+		if elapsed <= 0:
+			return 0.0
+
+		return self.bytes / elapsed
+
+	def getEta(self):
+		rate = self.getRate()
+
+		if not self.totalBytes or rate <= 0:
+			return None
+
+		return max(self.totalBytes - self.bytes, 0) / rate
+
+class FixJournal:
+	# Records how many chunks of a fixed film have been written, so a run
+	# that gets killed partway through can pick up where it left off.  The
+	# chunk layout and sample order are deterministic, so a hash of them
+	# plus the size and modification time of the input files is enough to
+	# tell whether a journal still matches the run being resumed.
+	#
+	# The output is flushed to disk before each journal update, and the
+	# journal itself is replaced atomically, so it never claims more than
+	# what is actually in the output.  Updates are made at most once every
+	# interval seconds.
+	def __init__(self, fileName, inputFiles, planHash, interval=5.0):
+		self.fileName = fileName
+		self.inputs = [self.getInputIdentity(inputFile) for inputFile in inputFiles]
+		self.planHash = planHash
+		self.interval = interval
+		self.lastUpdateTime = time.monotonic()
+
+	@staticmethod
+	def getInputIdentity(inputFile):
+		st = os.stat(inputFile)
+		return { "name": os.path.abspath(inputFile), "size": st.st_size, "mtime": st.st_mtime_ns }
+
+	@staticmethod
+	def getPlanHash(fixedFilm, order, times):
+		header = io.BytesIO()
+		fixedFilm.writeHeader(header)
+
+		h = hashlib.sha256(header.getvalue())
+		h.update(numpy.array(order, dtype=numpy.int64).tobytes())
+		h.update(numpy.array(times, dtype=numpy.float64).tobytes())
+
+		return h.hexdigest()
+
+	def load(self):
+		# Returns the number of chunks already written, or 0 if there is no
+		# journal to resume from.
+		try:
+			with open(self.fileName, "r") as f:
+				journal = json.load(f)
+		except FileNotFoundError:
+			print("WARNING: No checkpoint journal found at " + self.fileName + ", starting from the beginning")
+			return 0
+		except ValueError:
+			print("ERROR: Checkpoint journal " + self.fileName + " is corrupt")
+			sys.exit(1)
+
+		if journal.get("inputs") != self.inputs:
+			print("ERROR: Input files have changed since checkpoint journal " + self.fileName + " was written")
+			sys.exit(1)
+
+		if journal.get("plan") != self.planHash:
+			print("ERROR: Fix plan differs from the one in checkpoint journal " + self.fileName + ", were different options used?")
+			sys.exit(1)
+
+		self.offset = journal["offset"]
+
+		return journal["chunk"]
+
+	def update(self, f, chunk, force=False):
+		now = time.monotonic()
+		if not force and now - self.lastUpdateTime < self.interval:
+			return
+
+		self.lastUpdateTime = now
+
+		f.flush()
+		os.fsync(f.fileno())
+
+		journal = { "inputs": self.inputs, "plan": self.planHash, "chunk": chunk, "offset": f.tell() }
+		tmpName = self.fileName + ".tmp"
+		with open(tmpName, "w") as jOut:
+			json.dump(journal, jOut)
+			jOut.flush()
+			os.fsync(jOut.fileno())
+		os.replace(tmpName, self.fileName)
+
+	def remove(self):
+		if os.path.exists(self.fileName):
+			os.remove(self.fileName)
 
 class VidState:
 	def reset(self):
@@ -584,21 +1401,47 @@ class VidState:
 		self.aNextTime = float32(0)
 		self.firstAudioSample = True
 
-	def __init__(self, film, f):
+	def __init__(self, film, f, verbose=False, index=None, files=None, audioSource=None, audioLead=None):
 		self.sampleRate = float32(film.audioDesc.sampleRate)
 		self.timescale = float32(film.getTimescale())
 		self.film = film
 		self.file = f
-		if self.film.isChunky():
-			# Handle one-chunk films :-(
-			self.chunkDuration = self.film.chunkTable.chunkRecords[1].time - self.film.chunkTable.chunkRecords[0].time
+		self.verbose = verbose
+		self.index = index
+		if files != None:
+			self.files = files
+		else:
+			self.files = [f]
+		# Provides the data of generated audio samples, if not silence
+		self.audioSource = audioSource
+		# How far ahead of its play time, in timescale units, each audio
+		# sample after the first is placed in the stream.  By default that
+		# is half the duration of the first audio sample.
+		self.audioLead = audioLead
+		self.fixedSampleOrder = None
+
+	def setAudioLead(self, audioLead):
+		self.audioLead = audioLead
+		self.fixedSampleOrder = None
+
+	def getIndex(self):
+		if self.index == None:
+			self.index = SampleIndex(film=self.film, f=self.file)
+
+		return self.index
 
 	def setNextAudioSampleTime(self, curSample):
+		self.addAudioSample(curSample.size)
+
+	def addAudioSample(self, size):
 		# XXX assumes 8-bit audio
-		sampleDuration = (float32(curSample.size) / self.sampleRate) * self.timescale
+		sampleDuration = (float32(size) / self.sampleRate) * self.timescale
 		#print("Audio sample duration: " + str(sampleDuration))
 		if self.firstAudioSample:
-			self.aNextTime += float32(sampleDuration) / float32(2.0)
+			if self.audioLead != None:
+				self.aNextTime += float32(sampleDuration) - float32(self.audioLead)
+			else:
+				self.aNextTime += float32(sampleDuration) / float32(2.0)
 			self.firstAudioSample = False
 		else:
 			self.aNextTime = float32(sampleDuration) + self.aNextTime
@@ -651,288 +1494,314 @@ class VidState:
 
 		return True
 
-	def getFixedChunkTable(self):
+	def getFixedSampleOrder(self):
+		# Replay the interleave over the sample index.  Returns the index
+		# positions of the samples in their fixed order along with their
+		# new sample times.
+		if self.fixedSampleOrder != None:
+			return self.fixedSampleOrder
+
 		self.reset()
 
-		asi = AudioSampleIterator(self.film, self.file).__iter__()
-		vsi = VideoSampleIterator(self.film, self.file).__iter__()
+		index = self.getIndex()
+		sizes = index.sizes.tolist()
+		durations = index.durations.tolist()
+		audioSamples = numpy.flatnonzero(index.audio).tolist()
+		videoSamples = numpy.flatnonzero(~index.audio).tolist()
+		nextAudio = 0
+		nextVideo = 0
+
+		order = []
+		times = []
+
+		while True:
+			if self.calcNextSampleType() == 'Audio' and nextAudio < len(audioSamples):
+				i = audioSamples[nextAudio]
+				nextAudio += 1
+				times.append(0x7FFFFFFF)
+				self.addAudioSample(sizes[i])
+			elif nextVideo < len(videoSamples):
+				i = videoSamples[nextVideo]
+				nextVideo += 1
+				times.append(self.vidTime)
+				self.vidTime += durations[i]
+			else:
+				# Audio is pre-buffered in the stream to ensure the
+				# audio buffer in the player doesn't empty, so we will
+				# always run out of audio samples near the end of the
+				# stream even when interleaving them correctly.  Hence,
+				# it is safe to assume running out of video samples
+				# means we've reached the end of the stream.
+				break
+
+			order.append(i)
+
+		self.fixedSampleOrder = (order, times)
+
+		return self.fixedSampleOrder
+
+	def getFixedSampleIndex(self, fixedFilm):
+		# Describes the samples of fixedFilm as writeFixedData() lays them
+		# out, without writing or reading back any data.
+		index = self.getIndex()
+		(order, times) = self.getFixedSampleOrder()
+		order = numpy.array(order, dtype=numpy.int64)
+		sizes = index.sizes[order]
+		chunkRecs = fixedFilm.chunkTable.chunkRecords
+
+		# Each chunk holds the samples that fill it past its header
+		recordSizes = sizes + 16
+		streamBytes = numpy.cumsum(recordSizes) - recordSizes
+		payloadSizes = numpy.array([cRec.size - (64 + 16) for cRec in chunkRecs], dtype=numpy.int64)
+		payloadStarts = numpy.cumsum(payloadSizes) - payloadSizes
+		chunks = numpy.searchsorted(payloadStarts, streamBytes, side='right') - 1
+
+		firstSamples = numpy.searchsorted(chunks, chunks, side='left')
+		counts = numpy.bincount(chunks, minlength=len(chunkRecs))
+		chunkStarts = numpy.array([cRec.start for cRec in chunkRecs], dtype=numpy.int64)
+		streamData = numpy.cumsum(sizes) - sizes
+		offsets = fixedFilm.getDataOffset() + chunkStarts[chunks] + 64 + 16 + counts[chunks] * 16 + streamData - streamData[firstSamples]
+
+		return SampleIndex(offsets=offsets, sizes=sizes, times=numpy.array(times, dtype=numpy.int64), syncs=index.syncs[order], durations=index.durations[order], chunks=chunks)
+
+	def getFixedSeekIndex(self, fixedFilm):
+		return SeekIndex(timescale=self.film.getTimescale(), entries=getSeekEntries(self.getFixedSampleIndex(fixedFilm), fixedFilm))
+
+	def _addFixedChunk(self, newChunks, curRec, curChunkDuration):
+		if self.verbose:
+			print("Adding fixed chunk rec #" + str(len(newChunks)) + " from " + str(curRec.time) + " to " + str(curRec.time + curChunkDuration) + " of size " + hex(curRec.size))
+		newChunks.append(curRec)
+		newStart = curRec.start + curRec.size
+		newTime = curRec.time + curChunkDuration
+		newPattern = curRec.syncPattern + 0x01010101
+		if newPattern >= 0x80808080:
+			newPattern = 0x20202020
+		# Init size to size of sync pattern+empty sample table
+		return ChunkRec(start=newStart, size=64+16, time=newTime, syncPattern=newPattern)
+
+	def getFixedChunkTable(self, policy=None):
+		if policy == None:
+			policy = ChunkPolicy()
+
+		index = self.getIndex()
+		(order, times) = self.getFixedSampleOrder()
+		sizes = index.sizes.tolist()
+		durations = index.durations.tolist()
+		audio = index.audio.tolist()
+
+		chunkDuration = policy.getChunkDuration(self.film)
+		maxChunkSize = policy.getMaxChunkSize(chunkDuration, self.film.getTimescale())
 
 		newChunks = []
-		# XXX Write a syncPatten "forever" iterator
 		# Init size to size of sync pattern + empty sample table
 		curRec = ChunkRec(start=0, size=64+16, time=0, syncPattern=0x20202020)
 		curChunkDuration = 0
-		done = False
-
-		while not done:
-			nextType = self.calcNextSampleType()
-
-			sample = None
-			if nextType == 'Audio':
-				try:
-					sample = next(asi)
-				except StopIteration:
-					# This is normal.  Audio is pre-buffered
-					# in the stream to ensure the audio
-					# buffer in the player doesn't empty, so
-					# we will always run out of audio
-					# samples near the end of the stream
-					# even when interleaving them correctly.
-					pass
-			if sample == None:
-				try:
-					sample = next(vsi)
-				except StopIteration:
-					# Due to the note above about audio
-					# samples being pre-buffered, it is safe
-					# to assume running out of video samples
-					# means we've reached the end of the
-					# stream.
-					done = True
-
-				if sample != None:
-					curChunkDuration += sample.record.duration
-				else:
-					# Assert done == True
-					pass
-
-			if sample != None:
-				# Add in the size of the sample
-				curRec.size += sample.record.size
-				# Add in the size of a sample record
-				curRec.size += 16
-			else:
-				# Assert done == True
-				pass
-
-			if curChunkDuration >= self.chunkDuration or done:
-				print("Adding fixed chunk rec #" + str(len(newChunks)) + " from " + str(curRec.time) + " to " + str(curRec.time + curChunkDuration) + " of size " + hex(curRec.size))
-				newChunks.append(curRec)
-				newStart = curRec.start + curRec.size
-				newTime = curRec.time + curChunkDuration
-				newPattern = curRec.syncPattern + 0x01010101
-				if newPattern >= 0x80808080:
-					newPattern = 0x20202020
-				# Initi size to size of sync pattern+empty sample table
-				curRec = ChunkRec(start=newStart, size=64+16, time=newTime, syncPattern=newPattern)
+
+		for i in order:
+			# Add in the size of the sample and its sample record
+			sampleSize = sizes[i] + 16
+
+			if maxChunkSize != None and curRec.size > 64+16 and curRec.size + sampleSize > maxChunkSize:
+				curRec = self._addFixedChunk(newChunks, curRec, curChunkDuration)
 				curChunkDuration = 0
 
-			if sample != None:
-				self.processSample(sample.record)
-			else:
-				# Assert done == True
-				pass
+			curRec.size += sampleSize
+			if not audio[i]:
+				curChunkDuration += durations[i]
 
-		return ChunkTable(timescale=self.film.getTimescale(), chunkRecords=newChunks)
+			if curChunkDuration >= chunkDuration:
+				curRec = self._addFixedChunk(newChunks, curRec, curChunkDuration)
+				curChunkDuration = 0
 
-	def writeFixedData(self, fixedFilm, f):
-		self.reset()
+		# The chunk in progress is added even if it is empty, marking the
+		# end of the stream.
+		self._addFixedChunk(newChunks, curRec, curChunkDuration)
+
+		chunkTable = ChunkTable(timescale=self.film.getTimescale(), chunkRecords=newChunks)
+
+		if policy.getMaxRate() != None:
+			self.printBandwidth(chunkTable, order, times, policy.getMaxRate())
 
-		asi = AudioSampleIterator(self.film, self.file, readSampleData=True).__iter__()
-		vsi = VideoSampleIterator(self.film, self.file, readSampleData=True).__iter__()
+		return chunkTable
 
-		for cRec in fixedFilm.chunkTable.chunkRecords:
-			newSamples = []
+	def printBandwidth(self, chunkTable, order, times, maxRate):
+		index = self.getIndex()
+		timescale = float(self.film.getTimescale())
+		order = numpy.array(order, dtype=numpy.int64)
+
+		# The video time each sample in the fixed stream is read at
+		isVideo = ~index.audio[order]
+		vidDurations = numpy.where(isVideo, index.durations[order], 0)
+		vidTimes = (numpy.cumsum(vidDurations) - vidDurations) / timescale
+
+		# Bytes read from the start of the stream up to each sample
+		streamBytes = numpy.zeros(len(order) + 1, dtype=numpy.int64)
+		numpy.cumsum(index.sizes[order] + 16, out=streamBytes[1:])
+
+		# Bytes read in the second of video time following each sample
+		windowEnds = numpy.searchsorted(vidTimes, vidTimes + 1.0, side='left')
+		windowBytes = streamBytes[windowEnds] - streamBytes[:-1]
+
+		chunkSizes = numpy.array([cRec.size for cRec in chunkTable.chunkRecords])
+		print("Largest fixed chunk: " + hex(int(chunkSizes.max())) + " bytes")
+
+		if len(windowBytes) == 0:
+			return
+
+		peak = int(numpy.argmax(windowBytes))
+		print("Peak sustained rate: " + str(int(windowBytes[peak]) // 1024) + " KiB/s at " + "{:.2f}".format(vidTimes[peak]) + "s, drive rate: " + str(maxRate // 1024) + " KiB/s")
+
+		overRate = windowBytes > maxRate
+		if overRate.any():
+			first = int(numpy.argmax(overRate))
+			print("WARNING: Sustained rate exceeds the drive rate in " + str(int(numpy.count_nonzero(overRate))) + " of " + str(len(overRate)) + " sample windows, starting at " + "{:.2f}".format(vidTimes[first]) + "s")
+
+	def getFixedChunks(self, fixedFilm, startChunk=0):
+		# Lays out the chunks of fixedFilm from startChunk on, without
+		# reading any sample data.  Yields the number of each chunk, the
+		# chunk with its new sample table, and the index positions of the
+		# samples in it.
+		index = self.getIndex()
+		(order, times) = self.getFixedSampleOrder()
+		nextSample = 0
+
+		for (cNum, cRec) in enumerate(fixedFilm.chunkTable.chunkRecords):
 			newSampleRecs = []
+			positions = []
 			# Init size to size of sync pattern + empty sync table
 			chunkHdrSize = 64 + 16
 			chunkDataSize = 0
 
+			if cNum < startChunk:
+				# Only the sample sizes are needed to skip a chunk
+				while chunkDataSize < cRec.size - chunkHdrSize:
+					chunkDataSize += int(index.sizes[order[nextSample]])
+					chunkHdrSize += 16
+					nextSample += 1
+				continue
+
 			while chunkDataSize < cRec.size - chunkHdrSize:
-				nextType = self.calcNextSampleType()
-
-				sample = None
-				if nextType == 'Audio':
-					try:
-						sample = next(asi)
-					except StopIteration:
-						pass
-
-				if sample == None:
-					try:
-						sample = next(vsi)
-					except StopIteration:
-						print("Ran out of video samples while writing sample data")
-						sys.exit(1)
-
-				if sample.record.isAudio():
-					newTime = sample.record.time
-				else:
-					newTime = self.vidTime
+				if nextSample >= len(order):
+					print("Ran out of video samples while writing sample data")
+					sys.exit(1)
 
-				newSampleRec = SampleRec(start=chunkDataSize, size=sample.record.size, time=newTime, shadowSyncSample=sample.record.shadowSyncSample, duration=sample.record.duration)
+				i = order[nextSample]
+				sRec = index.getRecord(i)
+				newSampleRec = SampleRec(start=chunkDataSize, size=sRec.size, time=times[nextSample], shadowSyncSample=sRec.shadowSyncSample, duration=sRec.duration)
 				newSampleRecs.append(newSampleRec)
 				# Add in sample data size
 				chunkDataSize += newSampleRec.size
 				# Add in sample record size
 				chunkHdrSize += 16
-				newSamples.append(Sample(newSampleRec, sample.data))
+				positions.append(i)
 
-				self.processSample(sample.record)
+				nextSample += 1
 
 			newSampleTable = SampleTable(timescale=self.film.getTimescale(), sampleRecords=newSampleRecs)
 			chunk = Chunk(fileOffset=cRec.start, syncPattern=cRec.syncPattern, sampleTable=newSampleTable)
-			chunk.writeHeader(f)
-			for s in newSamples:
-				f.write(s.data)
-
-parser = ArgumentParser(description="Jaguar Cinepak Audio Fixer v" +
-			VERSION_STRING)
-parser.add_argument('-o', '--fixed-file', type=str, required=True,
-		    help='Name of file to store the output in')
-parser.add_argument('-a', '--fixed-aiff-file', type=str,
-		    help='Name of file to store the fixed cinepak data in with an AIFF wrapper.  If not specified, no AIFF file is generated')
-parser.add_argument('-t', '--fixed-track-file', type=str,
-		    help='Name of a track file to store the fixed cinepak data in with an AIFF and track wrapper in.  If not specified, no track file is generated.')
-parser.add_argument('-n', '--track-number', type=int,
-		    help='Track number to embed in the generated track file')
-parser.add_argument('-z', '--leading-zero-word', action='store_true',
-		    help='Write a dummy ZERO word at the start of the track file')
-parser.add_argument('input_file', metavar='INPUT_FILE',
-		    help='Chunk cinepak file')
-
-args = parser.parse_args()
-
-if args.fixed_track_file != None:
-	if args.fixed_aiff_file == None:
-		print("ERROR: An AIFF file is required to generate a track file")
-		sys.exit(1)
-
-	if args.track_number == None:
-		print("ERROR: Track number must be specified when writing a track file")
-		sys.exit(1)
 
-with open(args.input_file, "rb") as cpkIn:
-	film = Film(f=cpkIn)
+			yield (cNum, chunk, positions)
 
-	cType = film.frameDesc.compressionType
-
-	if cType == b'cvid':
-		print("Processed Cinepak compressed-RGB movie")
-	elif cType == b'$CRY':
-		print("Processed Cinepak expanded-CRY movie")
-	elif cType == b'$RGB':
-		print("Processed Cinepak expanded-RGB movie")
-	else:
-		print("Unknown Cinepak compression type!")
-		sys.exit(1)
-
-	print("Resolution: " + str(film.frameDesc.width) + "x" + str(film.frameDesc.height))
-
-	if film.audioDesc.bits == 8:
-		bits = "8-bit"
-	else:
-		bits = "16-bit"
-
-	if film.audioDesc.signed == 1:
-		signed = "signed"
-	else:
-		signed = "unsigned"
-
-	if film.audioDesc.channels == 2:
-		channels = "stereo"
-	else:
-		channels = "mono"
-
-	print(bits + " " + signed + " " + channels + " (" + film.audioDesc.compression + ") Audio")
-	print("Audio SCLK: " + str(film.audioDesc.sclk))
-	print("Audio drift rate: " + str(film.audioDesc.driftRate))
-	print("Audio sample rate: " + str(film.audioDesc.sampleRate))
+	def getSampleData(self, i):
+		index = self.getIndex()
+		fileId = index.fileIds[i]
 
-	if film.chunkTable == None:
-		print("Smooth file")
-	else:
-		print("Chunky file")
-
-		vs = VidState(film, cpkIn)
-		vs.checkFilm()
-
-	with open(args.fixed_file, "wb") as cpkOut:
-		print("Writing new film header")
-
-		# First create a new sample or chunk table
-		vs = VidState(film, cpkIn)
-		if film.isChunky():
-			fixedSampleTable = None
-			fixedChunkTable = vs.getFixedChunkTable()
+		if fileId >= 0:
+			return index.getSample(self.files[fileId], i, readData=True).data
+		elif self.audioSource != None:
+			return self.audioSource.read(i)
 		else:
-			fixedSampleTable = vs.getFixedSampleTable()
-			fixedChunkTable = None
+			return self.film.audioDesc.getSilence(int(index.sizes[i]))
 
-		fixedFilm = Film(frameDesc=film.frameDesc, audioDesc=film.audioDesc, chunkTable=fixedChunkTable, sampleTable=fixedSampleTable)
-		fixedFilm.writeHeader(cpkOut)
+	def writeFixedData(self, fixedFilm, f, progress=None, startChunk=0, checkpoint=None):
+		# Chunks before startChunk are assumed to already be in f, which
+		# must be positioned at the end of them.  checkpoint, if given, is
+		# called with the number of chunks written after each one.
+		chunkRecs = fixedFilm.chunkTable.chunkRecords
 
-		vs.writeFixedData(fixedFilm, cpkOut)
+		for (cNum, chunk, positions) in self.getFixedChunks(fixedFilm, startChunk):
+			chunk.writeHeader(f)
+			for i in positions:
+				f.write(self.getSampleData(i))
+
+			if progress != None:
+				progress.update(chunkRecs[cNum].size, len(positions))
 
-if args.fixed_aiff_file == None:
-	sys.exit(0)
+			if checkpoint != None:
+				checkpoint(cNum + 1)
 
 # Wrap the fixed file in a dummy AIFF header and (obsolete) sync marker padding
 # Details on the AIFF file format are available here:
 #   http://www-mmsp.ece.mcgill.ca/Documents/AudioFormats/AIFF/Docs/AIFF-1.3.pdf
-with open(args.fixed_file, "rb") as cpkIn, open(args.fixed_aiff_file, "wb") as aifOut:
-	cpkIn.seek(0, 2) # Seek to 0 bytes from SEEK_END
-	cpkSize = cpkIn.tell()
-	cpkIn.seek(0, 0) # Seek to 0 bytes from SEEK_SET
-
-	# (24 x 2352) - 2 (2352 == CD block size) blocks of 'A'.  Note
-	# JagCinePak uses 0xdc82 instead.  The Jaguar Cinepak documentation
-	# suggests 0xdc7e is used, as is done here.  The cpkdemo's player.inc
-	# uses 0xdc80, which is an even mulitple of CDDA blocks.
-	#
-	# In practice, since the player looks for the sync pattern that follows
-	# this padding using a large search window, the exact size used here
-	# does not matter.  What does matter is that the sync pattern ends up
-	# long-word aligned.  24 x 2352 is long-word aligned, but the player is
-	# not accounting for the size of the AIFF header (The original reason
-	# for including an AIFF header was that the CD mastering software
-	# expected it and would strip it out before burning.  However, Atari
-	# then stopped trying to support such software it seems, and added the
-	# separate track header/trailer data structures, but apparently
-	# neglected to stop wrapping their cinepak files in AIFF headers before
-	# wrapping them in track headers/trailers, so the AIFF header ends up on
-	# the disk just wasting space, and the player is still written as if it
-	# expects the AIFF header to have been stripped).  Since the AIFF header
-	# is not a long-word aligned size (0x36), using the correct long-word
-	# aligned padding size here will throw off the sync marker alignment and
-	# the player won't find it.  To compensate, the padding size must be
-	# rounded up or down 2 bytes.  JagCinePak rounded up, perhaps matching
-	# the original Atari tool's implementation (I don't have access to that
-	# tool, just speculating).  I'm rounding down to match the
-	# documentation.
-	leaderSize = 0xdc7e
-
-	# 64 bytes of '1'.  Note JagCinePak doesn't include this in its AIFF
-	# size fields.
-	#
-	# As noted above, it is CRITICAL that this data be long-word aligned in
-	# the final track on disk, or the player will fail to locate the movie.
-	syncDataSize = 0x40
+#
+# (24 x 2352) - 2 (2352 == CD block size) blocks of 'A'.  Note
+# JagCinePak uses 0xdc82 instead.  The Jaguar Cinepak documentation
+# suggests 0xdc7e is used, as is done here.  The cpkdemo's player.inc
+# uses 0xdc80, which is an even mulitple of CDDA blocks.
+#
+# In practice, since the player looks for the sync pattern that follows
+# this padding using a large search window, the exact size used here
+# does not matter.  What does matter is that the sync pattern ends up
+# long-word aligned.  24 x 2352 is long-word aligned, but the player is
+# not accounting for the size of the AIFF header (The original reason
+# for including an AIFF header was that the CD mastering software
+# expected it and would strip it out before burning.  However, Atari
+# then stopped trying to support such software it seems, and added the
+# separate track header/trailer data structures, but apparently
+# neglected to stop wrapping their cinepak files in AIFF headers before
+# wrapping them in track headers/trailers, so the AIFF header ends up on
+# the disk just wasting space, and the player is still written as if it
+# expects the AIFF header to have been stripped).  Since the AIFF header
+# is not a long-word aligned size (0x36), using the correct long-word
+# aligned padding size here will throw off the sync marker alignment and
+# the player won't find it.  To compensate, the padding size must be
+# rounded up or down 2 bytes.  JagCinePak rounded up, perhaps matching
+# the original Atari tool's implementation (I don't have access to that
+# tool, just speculating).  I'm rounding down to match the
+# documentation.
+AIFF_LEADER_SIZE = 0xdc7e
+
+# 64 bytes of '1'.  Note JagCinePak doesn't include this in its AIFF
+# size fields.
+#
+# As noted above, it is CRITICAL that this data be long-word aligned in
+# the final track on disk, or the player will fail to locate the movie.
+AIFF_SYNC_DATA_SIZE = 0x40
+
+# 22146 bytes (Unknown reason for this size) of 'B'. This is not
+# documented anywhere I can find, and I see no reason for it, but
+# including it to match JagCinePak.
+AIFF_TRAILER_SIZE = 0x5682
 
-	# 22146 bytes (Unknown reason for this size) of 'B'. This is not
-	# documented anywhere I can find, and I see no reason for it, but
-	# including it to match JagCinePak.
-	trailerSize = 0x5682
+# AIFF Common chunk size:
+AIFF_COMMON_SIZE = 0x12
 
-	# AIFF Common chunk size:
-	commonSize = 0x12
+# AIFF Sound metadata size:
+AIFF_SOUND_META_SIZE = 0x8
 
-	# AIFF Sound metadata size:
-	soundMetaSize = 0x8
+# FORM header + common chunk + sound chunk header + sound metadata
+AIFF_HEADER_SIZE = 0xc + 0x8 + AIFF_COMMON_SIZE + 0x8 + AIFF_SOUND_META_SIZE
 
+def getAiffSoundDataSize(cpkSize):
+	return cpkSize + AIFF_LEADER_SIZE + AIFF_SYNC_DATA_SIZE + AIFF_TRAILER_SIZE
+
+def getAiffSize(cpkSize):
+	return AIFF_HEADER_SIZE + getAiffSoundDataSize(cpkSize)
+
+def writeAiffHeader(f, cpkSize):
 	# soundData field size
-	soundDataSize = cpkSize + leaderSize + syncDataSize + trailerSize
+	soundDataSize = getAiffSoundDataSize(cpkSize)
 
 	# chunk size of sound block
-	soundSize = soundDataSize + soundMetaSize
+	soundSize = soundDataSize + AIFF_SOUND_META_SIZE
 
 	# formType + common chunk header + sound chunk header + data
-	formSize = 0x4 + 0x8 + 0x8 + commonSize + soundSize
+	formSize = 0x4 + 0x8 + 0x8 + AIFF_COMMON_SIZE + soundSize
 
 	# Write the FORM chunk header
-	aifOut.write(b'FORM')
-	aifOut.write(uintBytes(formSize))
-	aifOut.write(b'AIFF')
+	f.write(b'FORM')
+	f.write(uintBytes(formSize))
+	f.write(b'AIFF')
 
 	# Write the common chunk
 	#
@@ -957,123 +1826,2098 @@ with open(args.fixed_file, "rb") as cpkIn, open(args.fixed_aiff_file, "wb") as a
 	#
 	# But note it is the same as x87 80-bit floating point, and
 	# documentation for that is more readily available.
-	aifOut.write(b'COMM')
-	aifOut.write(uintBytes(commonSize))
+	f.write(b'COMM')
+	f.write(uintBytes(AIFF_COMMON_SIZE))
 	# Channels
-	aifOut.write(uint16Bytes(2))
+	f.write(uint16Bytes(2))
 	# Sample Frames
-	aifOut.write(uintBytes(soundDataSize))
+	f.write(uintBytes(soundDataSize))
 	# Sample size
-	aifOut.write(uint16Bytes(8))
+	f.write(uint16Bytes(8))
 	# Sample rate:
 	#  sign=0 (positive)
 	#  exponent=15 (0x400e - 0x3fff)
 	#  i=1 (normalized)
 	#  fraction=0x2c44000000000000
 	#  Packed we get 0x400eac44000000000000, broken into 5 words
-	aifOut.write(uint16Bytes(0x400e))
-	aifOut.write(uint16Bytes(0xac44))
-	aifOut.write(uint16Bytes(0x0000))
-	aifOut.write(uint16Bytes(0x0000))
-	aifOut.write(uint16Bytes(0x0000))
+	f.write(uint16Bytes(0x400e))
+	f.write(uint16Bytes(0xac44))
+	f.write(uint16Bytes(0x0000))
+	f.write(uint16Bytes(0x0000))
+	f.write(uint16Bytes(0x0000))
 
 	# Write the sound chunk
-	aifOut.write(b'SSND')
-	aifOut.write(uintBytes(soundSize))
+	f.write(b'SSND')
+	f.write(uintBytes(soundSize))
 
 	# offset
-	aifOut.write(uintBytes(0))
+	f.write(uintBytes(0))
 
 	# blockSize
-	aifOut.write(uintBytes(0))
+	f.write(uintBytes(0))
 
-	# Write the "sound" data:
-	for i in range(leaderSize >> 2):
-		aifOut.write(b'AAAA')
-	for i in range(leaderSize & 0x3):
-		aifOut.write(b'A')
+	# Write the "sound" data leading the film:
+	f.write(b'A' * AIFF_LEADER_SIZE)
+	f.write(b'1' * AIFF_SYNC_DATA_SIZE)
 
-	for i in range(syncDataSize >> 2):
-		aifOut.write(b'1111')
-
-	while True:
-		buf = cpkIn.read(0x1000)
+def writeAiffTrailer(f, seekIndex=None):
+	trailerSize = AIFF_TRAILER_SIZE
 
-		if buf:
-			aifOut.write(buf)
+	# The trailer padding is otherwise unused, so a seek index can be
+	# stored at its start if it fits.
+	if seekIndex != None:
+		if seekIndex.getSize() <= trailerSize:
+			seekIndex.write(f)
+			trailerSize -= seekIndex.getSize()
 		else:
-			break
+			print("WARNING: Seek index is too large to embed in the AIFF trailer")
 
-	for i in range(trailerSize >> 2):
-		aifOut.write(b'BBBB')
-	for i in range(trailerSize & 0x3):
-		aifOut.write(b'B')
+	f.write(b'B' * trailerSize)
 
-if args.fixed_track_file == None:
-	sys.exit(0)
+# Jaguar CD track header/trailer
+#
+# From the Jaguar CD-ROM documentation, section 6.1:
+#
+# Jaguar CD header format:
+#   Optional dummy zero word (0x0000) to force alignment
+#   16 long-words of 'ATRI'
+#   'ATARI APPROVED DATA HEADER ATRI'
+#   0x20 + <track number>
+#
+# Jaguar CD trailer format:
+#   'ATARI APPROVED DATA TAILER ATRI'
+#   0x20 + <track number>
+#   16 long-words of 'ATRI'
+#
+# <track number> is zero-based.
+#
+# The beginning and end of these markers must be long-word aligned.
+# The optional leading zero-word is intended to ensure that alignment
+# on mastering/burning software that inserts a dummy zero word of its
+# own (2 + 2 = 4, long word aligned).
+#
+# From inspection of track files generated by both Atari's maketrk and
+# JagCinePak, a 'partition marker', defaulting to TR<track number>, is
+# added just after the header as well.
+TRACK_HEADER_SIZE = 0x40 + 0x1f + 0x1 + 0x40
+TRACK_TRAILER_SIZE = 0x1f + 0x1 + 0x40
 
-# Wrap the AIFF-wrapped file with Jaguar CD track header/trailer
-with open(args.fixed_aiff_file, "rb") as aifIn, open(args.fixed_track_file, "wb") as trkOut:
-	# From the Jaguar CD-ROM documentation, section 6.1:
-	#
-	# Jaguar CD header format:
-	#   Optional dummy zero word (0x0000) to force alignment
-	#   16 long-words of 'ATRI'
-	#   'ATARI APPROVED DATA HEADER ATRI'
-	#   0x20 + <track number>
-	#
-	# Jaguar CD trailer format:
-	#   'ATARI APPROVED DATA TAILER ATRI'
-	#   0x20 + <track number>
-	#   16 long-words of 'ATRI'
-	#
-	# <track number> is zero-based.
-	#
-	# The beginning and end of these markers must be long-word aligned.
-	# The optional leading zero-word is intended to ensure that alignment
-	# on mastering/burning software that inserts a dummy zero word of its
-	# own (2 + 2 = 4, long word aligned).
-	#
-	# From inspection of track files generated by both Atari's maketrk and
-	# JagCinePak, a 'partition marker', defaulting to TR<track number>, is
-	# added just after the header as well.
+def getTrackPaddingSize(aifSize):
+	return (4 - (aifSize & 0x3)) % 4
 
-	aifIn.seek(0, 2) # Seek to 0 bytes from SEEK_END
-	aifSize = aifIn.tell()
-	aifIn.seek(0, 0) # Seek to 0 bytes from SEEK_SET
+def getTrackSize(aifSize, leadingZeroWord):
+	size = TRACK_HEADER_SIZE + aifSize + getTrackPaddingSize(aifSize) + TRACK_TRAILER_SIZE
 
-	# Write dummy zero word?
-	writeDummyZero = args.leading_zero_word
+	if leadingZeroWord:
+		size += 2
 
-	if writeDummyZero:
-		trkOut.write(uint16Bytes(0x0000))
+	return size
+
+def writeTrackHeader(f, trackNumber, leadingZeroWord):
+	# Write dummy zero word?
+	if leadingZeroWord:
+		f.write(uint16Bytes(0x0000))
 
 	# Write the Atari track header
 	for i in range(16):
-		trkOut.write(b'ATRI')
-	trkOut.write(b'ATARI APPROVED DATA HEADER ATRI')
-	trkOut.write(uint8Bytes(0x20 + args.track_number))
+		f.write(b'ATRI')
+	f.write(b'ATARI APPROVED DATA HEADER ATRI')
+	f.write(uint8Bytes(0x20 + trackNumber))
+
+	marker = 'TR{:02X}'.format(trackNumber).encode(encoding='ascii')
+
+	for i in range(16):
+		f.write(marker)
 
-	marker = 'TR{:02X}'.format(args.track_number).encode(encoding='ascii')
+def writeTrackTrailer(f, trackNumber, aifSize):
+	# zero-pad the track data up to a long-word boundary.
+	f.write(bytes(getTrackPaddingSize(aifSize)))
 
+	# Write the Atari track trailer
+	f.write(b'ATARI APPROVED DATA TAILER ATRI')
+	f.write(uint8Bytes(0x20 + trackNumber))
 	for i in range(16):
-		trkOut.write(marker)
+		f.write(b'ATRI')
+
+# Reorder patches describe a fixed film as the bytes it shares with the
+# film(s) it was fixed from, rather than holding a copy of them.  All the
+# sample data of a fixed film comes from its input films, so only the new
+# film and chunk headers need to be stored in full.
+#
+# A patch starts with a header: the 'CPAT' tag, the size of the header, the
+# patch format version, the size of the fixed film as a 64-bit long-word,
+# the number of input films, then the size of each input film, again as a
+# 64-bit long-word, and then the SHA-256 digest of each input film.  The
+# digest only covers the parts of the film the patch doesn't copy from it,
+# which are its headers and sample tables, plus any sample data left out of
+# the fixed film.  That's enough to tell films of the same size apart
+# without reading all their sample data.  The rest of the file is a zlib
+# stream of operations that build the fixed film from start to end:
+#
+#   'DATA', a size long-word, and then that many bytes to write as-is
+#   'MOVE', the number of an input film, and a 64-bit offset and size of
+#           data in that film to copy
+PATCH_VERSION = 2
+
+class PatchWriter:
+	def __init__(self, f, outputSize, inputSizes, inputDigests):
+		self.file = f
+		self.compressor = zlib.compressobj(9)
+		self.pendingData = []
+		self.pendingMove = None
+		self.moveCount = 0
+
+		f.write(b'CPAT')
+		f.write(uintBytes(24 + 40 * len(inputSizes)))
+		f.write(uintBytes(PATCH_VERSION))
+		f.write(uint64Bytes(outputSize))
+		f.write(uintBytes(len(inputSizes)))
+		for size in inputSizes:
+			f.write(uint64Bytes(size))
+		for digest in inputDigests:
+			f.write(digest)
+
+	def _writeOp(self, op):
+		self.file.write(self.compressor.compress(op))
+
+	def _flushData(self):
+		if len(self.pendingData) > 0:
+			data = b''.join(self.pendingData)
+			self._writeOp(b'DATA' + uintBytes(len(data)) + data)
+			self.pendingData = []
+
+	def _flushMove(self):
+		if self.pendingMove != None:
+			(fileId, offset, size) = self.pendingMove
+			self._writeOp(b'MOVE' + uintBytes(fileId) + uint64Bytes(offset) + uint64Bytes(size))
+			self.moveCount += 1
+			self.pendingMove = None
+
+	def data(self, data):
+		self._flushMove()
+		self.pendingData.append(data)
+
+	def move(self, fileId, offset, size):
+		self._flushData()
+
+		# Samples that stay next to each other in the fixed film are
+		# usually next to each other in the input too, so merge them into
+		# one move.
+		if self.pendingMove != None:
+			(pFileId, pOffset, pSize) = self.pendingMove
+			if pFileId == fileId and pOffset + pSize == offset:
+				self.pendingMove = (fileId, pOffset, pSize + size)
+				return
+
+		self._flushMove()
+		self.pendingMove = (fileId, offset, size)
+
+	def close(self):
+		self._flushData()
+		self._flushMove()
+		self.file.write(self.compressor.flush())
+
+class PatchReader:
+	def __init__(self, f):
+		self.file = f
+		self.decompressor = zlib.decompressobj()
+		self.buf = bytearray()
+		self.pos = 0
+
+		if f.read(4) != b'CPAT':
+			print("ERROR: Not a reorder patch file")
+			sys.exit(1)
+
+		headerSize = getInt(f)
+		version = getInt(f)
+		if version != PATCH_VERSION:
+			print("ERROR: Unsupported reorder patch version " + str(version))
+			sys.exit(1)
+
+		self.outputSize = getInt64(f)
+		self.inputSizes = [getInt64(f) for i in range(getInt(f))]
+		self.inputDigests = [f.read(32) for i in range(len(self.inputSizes))]
+
+		if headerSize != f.tell():
+			print("ERROR: Invalid reorder patch header size")
+			sys.exit(1)
+
+	def _fill(self):
+		# Decompresses more of the patch into the buffer, returning False
+		# once the end of the compressed stream has been reached.  What's
+		# already been read is only dropped here, so reading the ops
+		# doesn't copy the rest of the buffer for every field.
+		if self.decompressor.eof:
+			return False
+
+		del self.buf[:self.pos]
+		self.pos = 0
+
+		compressed = self.file.read(0x10000)
+		if compressed:
+			self.buf += self.decompressor.decompress(compressed)
+		else:
+			self.buf += self.decompressor.flush()
+			if not self.decompressor.eof:
+				print("ERROR: Reorder patch file is truncated")
+				sys.exit(1)
 
+		return True
+
+	def _read(self, size):
+		while len(self.buf) - self.pos < size:
+			if not self._fill():
+				print("ERROR: Reorder patch file is truncated")
+				sys.exit(1)
+
+		data = bytes(self.buf[self.pos:self.pos + size])
+		self.pos += size
+
+		return data
+
+	def ops(self):
+		# Yields ('DATA', bytes) and ('MOVE', fileId, offset, size) tuples
+		while True:
+			while self.pos == len(self.buf):
+				if not self._fill():
+					return
+
+			op = self._read(4)
+			if op == b'DATA':
+				size = int.from_bytes(self._read(4), byteorder='big')
+				yield ('DATA', self._read(size))
+			elif op == b'MOVE':
+				fileId = int.from_bytes(self._read(4), byteorder='big')
+				offset = int.from_bytes(self._read(8), byteorder='big')
+				size = int.from_bytes(self._read(8), byteorder='big')
+				yield ('MOVE', fileId, offset, size)
+			else:
+				print("ERROR: Invalid operation in reorder patch file")
+				sys.exit(1)
+
+def getInputDigest(f, size, moveStarts, moveSizes):
+	# Hashes the parts of an input film, of the given size, that aren't
+	# copied from it by any of the moves.
+	order = numpy.argsort(moveStarts, kind='stable')
+	starts = numpy.asarray(moveStarts, dtype=numpy.int64)[order]
+	ends = starts + numpy.asarray(moveSizes, dtype=numpy.int64)[order]
+
+	# Each gap runs from the furthest any earlier move reaches to the start
+	# of the next move.
+	gapStarts = numpy.concatenate(([0], numpy.maximum.accumulate(ends)))
+	gapEnds = numpy.concatenate((starts, [size]))
+	gaps = numpy.flatnonzero(gapEnds > gapStarts)
+
+	h = hashlib.sha256()
+	for i in gaps:
+		offset = int(gapStarts[i])
+		f.seek(offset, 0) # Seek offset bytes from SEEK_SET
+		while offset < gapEnds[i]:
+			data = f.read(min(0x100000, int(gapEnds[i]) - offset))
+			if not data:
+				break
+			h.update(data)
+			offset += len(data)
+
+	return h.digest()
+
+def writeFixedPatch(vs, fixedFilm, f, inputSizes):
+	# No sample data is read to build a patch, only the sample index and
+	# the parts of the input films it doesn't copy.
+	index = vs.getIndex()
+	used = numpy.array(vs.getFixedSampleOrder()[0], dtype=numpy.int64)
+	inputDigests = []
+	for fileId in range(len(inputSizes)):
+		moves = used[index.fileIds[used] == fileId]
+		inputDigests.append(getInputDigest(vs.files[fileId], inputSizes[fileId], index.offsets[moves], index.sizes[moves]))
+
+	writer = PatchWriter(f, getFilmSize(fixedFilm), inputSizes, inputDigests)
+
+	header = io.BytesIO()
+	fixedFilm.writeHeader(header)
+	writer.data(header.getvalue())
+
+	for (cNum, chunk, positions) in vs.getFixedChunks(fixedFilm):
+		header = io.BytesIO()
+		chunk.writeHeader(header)
+		writer.data(header.getvalue())
+
+		for i in positions:
+			fileId = int(index.fileIds[i])
+			if fileId >= 0:
+				writer.move(fileId, int(index.offsets[i]), int(index.sizes[i]))
+			else:
+				writer.data(vs.getSampleData(i))
+
+	writer.close()
+
+	return writer.moveCount
+
+def writeAll(f, data):
+	# Unbuffered files may write only part of the data
+	view = memoryview(data)
+	while len(view) > 0:
+		view = view[f.write(view):]
+
+def copyFileRange(fIn, fOut, offset, size, progress=None):
+	# Copies size bytes at offset in fIn to the current position of fOut,
+	# which must be unbuffered.  copy_file_range() lets the kernel copy the
+	# data without passing it through Python, or even share the blocks
+	# between the files on filesystems that support it.  Where it isn't
+	# available, or can't copy between these files, fall back to reading
+	# and writing the data.
+	useCopyRange = hasattr(os, 'copy_file_range')
+
+	while size > 0:
+		n = 0
+
+		if useCopyRange:
+			try:
+				n = os.copy_file_range(fIn.fileno(), fOut.fileno(), min(size, 0x40000000), offset)
+			except OSError:
+				useCopyRange = False
+
+		if n == 0:
+			data = os.pread(fIn.fileno(), min(size, 0x100000), offset)
+			if len(data) == 0:
+				print("ERROR: Input film is shorter than the reorder patch expects")
+				sys.exit(1)
+			writeAll(fOut, data)
+			n = len(data)
+
+		offset += n
+		size -= n
+
+		if progress != None:
+			progress.update(n)
+
+def getFileSize(f):
+	f.seek(0, 2) # Seek to 0 bytes from SEEK_END
+	size = f.tell()
+	f.seek(0, 0) # Seek to 0 bytes from SEEK_SET
+
+	return size
+
+def copyFileData(fIn, fOut, progress=None):
 	while True:
-		buf = aifIn.read(0x1000)
+		buf = fIn.read(0x100000)
 
 		if buf:
-			trkOut.write(buf)
+			fOut.write(buf)
+			if progress != None:
+				progress.update(len(buf))
 		else:
 			break
 
-	# zero-pad the track data up to a long-word boundary.
-	zeroPaddingSize = (4 - (aifSize & 0x3)) % 4
-	for i in range(zeroPaddingSize):
-		trkOut.write(uint8Bytes(0x00))
+def printFilmInfo(film):
+	cType = film.frameDesc.compressionType
 
-	# Write the Atari track trailer
-	trkOut.write(b'ATARI APPROVED DATA TAILER ATRI')
-	trkOut.write(uint8Bytes(0x20 + args.track_number))
-	for i in range(16):
-		trkOut.write(b'ATRI')
+	if cType == b'cvid':
+		print("Processed Cinepak compressed-RGB movie")
+	elif cType == b'$CRY':
+		print("Processed Cinepak expanded-CRY movie")
+	elif cType == b'$RGB':
+		print("Processed Cinepak expanded-RGB movie")
+	else:
+		print("Unknown Cinepak compression type!")
+		sys.exit(1)
+
+	print("Resolution: " + str(film.frameDesc.width) + "x" + str(film.frameDesc.height))
+
+	if film.audioDesc.bits == 8:
+		bits = "8-bit"
+	else:
+		bits = "16-bit"
+
+	if film.audioDesc.signed == 1:
+		signed = "signed"
+	else:
+		signed = "unsigned"
+
+	if film.audioDesc.getChannelCount() == 2:
+		channels = "stereo"
+	else:
+		channels = "mono"
+
+	print(bits + " " + signed + " " + channels + " (" + film.audioDesc.compression + ") Audio")
+	print("Audio SCLK: " + str(film.audioDesc.sclk))
+	print("Audio drift rate: " + str(film.audioDesc.driftRate))
+	print("Audio sample rate: " + str(film.audioDesc.sampleRate))
+
+	if film.chunkTable == None:
+		print("Smooth file")
+	else:
+		print("Chunky file")
+
+def getFixedFilm(film, vs, policy=None, toChunky=False):
+	# The sample index doesn't care how the input film is laid out, so a
+	# Smooth film gets the same chunk table a Chunky one with the same
+	# samples would, with its sync patterns counting up from the start.
+	if not film.isChunky() and not toChunky:
+		print("ERROR: Smooth films can't be fixed as Smooth films, use --to-chunky to convert them to Chunky films")
+		sys.exit(1)
+
+	return Film(frameDesc=film.frameDesc, audioDesc=film.audioDesc, chunkTable=vs.getFixedChunkTable(policy))
+
+def getFilmSize(film):
+	size = film.getDataOffset()
+
+	if film.chunkTable != None:
+		if len(film.chunkTable.chunkRecords) > 0:
+			lastRec = film.chunkTable.chunkRecords[-1]
+			size += lastRec.start + lastRec.size
+	elif len(film.sampleTable.sampleRecords) > 0:
+		lastRec = film.sampleTable.sampleRecords[-1]
+		size += lastRec.start + lastRec.size
+
+	return size
+
+# Jaguar CD session images
+#
+# Each track in a BIN image is made up of whole raw CD sectors, so every
+# track is zero-padded up to the next sector boundary.  The Red Book also
+# requires every track to be at least 4 seconds long.
+CD_MIN_TRACK_SECTORS = 4 * CD_SECTORS_PER_SECOND
+
+def getSectorCount(size):
+	return max((size + CD_SECTOR_SIZE - 1) // CD_SECTOR_SIZE, CD_MIN_TRACK_SECTORS)
+
+def getCueTime(sector):
+	minutes = sector // (60 * CD_SECTORS_PER_SECOND)
+	seconds = (sector // CD_SECTORS_PER_SECOND) % 60
+	frames = sector % CD_SECTORS_PER_SECOND
+
+	return '{:02d}:{:02d}:{:02d}'.format(minutes, seconds, frames)
+
+def planImageTrack(inputFile, policy=None, verbose=False, toChunky=False):
+	with open(inputFile, "rb") as cpkIn:
+		film = Film(f=cpkIn)
+
+		if not film.isChunky() and not toChunky:
+			print("ERROR: " + inputFile + " is not a Chunky film, use --to-chunky to convert it")
+			sys.exit(1)
+
+		vs = VidState(film, cpkIn, verbose)
+		fixedFilm = getFixedFilm(film, vs, policy, toChunky)
+
+		return (fixedFilm.chunkTable, getFilmSize(fixedFilm))
+
+def writeImageTrack(imageFile, offset, inputFile, fixedChunkTable, trackNumber, leadingZeroWord, embedSeekIndex=False, progressQueue=None):
+	if progressQueue != None:
+		progress = Progress(reporters=[ProgressQueueReporter(progressQueue)])
+	else:
+		progress = None
+
+	with open(inputFile, "rb") as cpkIn, open(imageFile, "r+b") as imgOut:
+		film = Film(f=cpkIn)
+		vs = VidState(film, cpkIn)
+		fixedFilm = Film(frameDesc=film.frameDesc, audioDesc=film.audioDesc, chunkTable=fixedChunkTable)
+		cpkSize = getFilmSize(fixedFilm)
+		aifSize = getAiffSize(cpkSize)
+
+		imgOut.seek(offset, 0) # Seek offset bytes from SEEK_SET
+
+		writeTrackHeader(imgOut, trackNumber, leadingZeroWord)
+		writeAiffHeader(imgOut, cpkSize)
+		fixedFilm.writeHeader(imgOut)
+		if progress != None:
+			progress.update(fixedFilm.getDataOffset())
+		vs.writeFixedData(fixedFilm, imgOut, progress)
+
+		if embedSeekIndex:
+			writeAiffTrailer(imgOut, vs.getFixedSeekIndex(fixedFilm))
+		else:
+			writeAiffTrailer(imgOut)
+
+		writeTrackTrailer(imgOut, trackNumber, aifSize)
+
+	if progress != None:
+		progress.finish()
+
+		# The rest of the track's last sector is left as the zeros the
+		# image file was extended with.
+
+def buildImage(args):
+	inputFiles = args.input_file
+	trackNumbers = args.image_track_number
+
+	if trackNumbers == None:
+		if args.track_number == None:
+			print("ERROR: Track numbers must be specified when writing an image file")
+			sys.exit(1)
+
+		trackNumbers = list(range(args.track_number, args.track_number + len(inputFiles)))
+
+	if len(trackNumbers) != len(inputFiles):
+		print("ERROR: Specify one track number per film with -N, or only the first track number with -n")
+		sys.exit(1)
+
+	for i in range(len(trackNumbers)):
+		if trackNumbers[i] < 0 or trackNumbers[i] > 98:
+			print("ERROR: Invalid track number: " + str(trackNumbers[i]))
+			sys.exit(1)
+
+		if i > 0 and trackNumbers[i] != trackNumbers[i - 1] + 1:
+			print("ERROR: Track numbers in an image file must be consecutive")
+			sys.exit(1)
+
+	cueFile = args.cue_file
+	if cueFile == None:
+		cueFile = os.path.splitext(args.image_file)[0] + '.cue'
+
+	with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+		# Plan every film up front so the location of each track in the
+		# image is known before any data is written.
+		policy = createChunkPolicy(args)
+		plans = list(executor.map(planImageTrack, inputFiles, [policy] * len(inputFiles), [args.verbose] * len(inputFiles), [args.to_chunky] * len(inputFiles)))
+
+		offsets = []
+		sectors = []
+		offset = 0
+		for (chunkTable, cpkSize) in plans:
+			trackSize = getTrackSize(getAiffSize(cpkSize), args.leading_zero_word)
+			trackSectors = getSectorCount(trackSize)
+
+			offsets.append(offset)
+			sectors.append(offset // CD_SECTOR_SIZE)
+			offset += trackSectors * CD_SECTOR_SIZE
+
+		with open(args.image_file, "wb") as imgOut:
+			imgOut.truncate(offset)
+
+		print("Writing " + str(len(inputFiles)) + " tracks to " + args.image_file)
+
+		progress = createProgress(args)
+		if progress != None:
+			manager = Manager()
+			progressQueue = manager.Queue()
+			progress.start("image", totalBytes=sum([plan[1] for plan in plans]))
+		else:
+			progressQueue = None
+
+		futures = []
+		for i in range(len(inputFiles)):
+			futures.append(executor.submit(writeImageTrack, args.image_file, offsets[i], inputFiles[i], plans[i][0], trackNumbers[i], args.leading_zero_word, args.embed_seek_index, progressQueue))
+
+		if progress != None:
+			# Sum up the progress of all the tracks until they are done
+			notDone = futures
+			while notDone:
+				notDone = wait(notDone, timeout=progress.interval)[1]
+				while not progressQueue.empty():
+					(nBytes, nSamples) = progressQueue.get()
+					progress.update(nBytes, nSamples)
+			progress.finish()
+			manager.shutdown()
+
+		for future in futures:
+			future.result()
+
+	with open(cueFile, "w") as cueOut:
+		cueOut.write('FILE "' + os.path.basename(args.image_file) + '" BINARY\n')
+		for i in range(len(inputFiles)):
+			# Jaguar track numbers are zero-based, CUE track numbers are not
+			cueOut.write('  TRACK {:02d} AUDIO\n'.format(trackNumbers[i] + 1))
+			cueOut.write('    INDEX 01 ' + getCueTime(sectors[i]) + '\n')
+
+# Recovery of Chunky films with damaged chunk tables
+#
+# Rather than trusting the chunk table, the data of the film is scanned for
+# what every chunk starts with: 64 bytes of the same sync pattern byte, then
+# a sample table.  Candidates are found with mmap.find(), which scans at
+# memory speed, and each one is only accepted if its sample table is
+# consistent and fits in the file.  The chunk table is then rebuilt from
+# the chunks actually found, in file order.
+def findChunks(mm, dataOffset, timescale=None):
+	# Returns (offset, size, time, syncPattern) for each chunk found at or
+	# after dataOffset, along with the timescale of their sample tables.
+	chunks = []
+	skipped = 0
+	nextTime = 0
+	searchStart = dataOffset
+	pos = mm.find(b'STAB', dataOffset + 64)
+
+	while pos >= 0:
+		syncOffset = pos - 64
+		sync = mm[syncOffset:pos]
+		size = None
+
+		if sync == sync[:1] * 64 and 0x20 <= sync[0] < 0x80 and pos + 16 <= len(mm):
+			(hdrSize, tableTimescale, count) = numpy.frombuffer(mm[pos + 4:pos + 16], dtype='>u4').tolist()
+
+			if hdrSize == 16 + 16 * count and pos + hdrSize <= len(mm) and (timescale == None or tableTimescale == timescale):
+				records = numpy.frombuffer(mm[pos + 16:pos + hdrSize], dtype='>u4').reshape(count, 4).astype(numpy.int64)
+				starts = records[:, 0]
+				sizes = records[:, 1]
+				dataSize = int((starts + sizes).max()) if count > 0 else 0
+
+				if (count == 0 or starts[0] == 0) and (starts >= 0).all() and pos + hdrSize + dataSize <= len(mm):
+					size = 64 + hdrSize + dataSize
+					timescale = tableTimescale
+
+		if size == None:
+			pos = mm.find(b'STAB', pos + 1)
+			continue
+
+		if syncOffset > searchStart:
+			print("WARNING: Skipping " + str(syncOffset - searchStart) + " bytes of damaged data at " + hex(searchStart))
+			skipped += syncOffset - searchStart
+
+		# Chunks start at the time of their first video frame
+		times = records[:, 2] & 0x7FFFFFFF
+		video = times != 0x7FFFFFFF
+		if video.any():
+			chunkTime = int(times[video][0])
+		else:
+			chunkTime = nextTime
+		nextTime = chunkTime + int(records[video, 3].sum())
+
+		chunks.append((syncOffset, size, chunkTime, int.from_bytes(sync[:4], byteorder='big')))
+
+		searchStart = syncOffset + size
+		pos = mm.find(b'STAB', searchStart + 64)
+
+	if len(mm) > searchStart:
+		print("WARNING: Skipping " + str(len(mm) - searchStart) + " bytes of damaged data at " + hex(searchStart))
+
+	return (chunks, timescale)
+
+def recoverFilm(f):
+	film = Film(f=f, headerOnly=True)
+
+	if film.type == 'Smooth':
+		print("ERROR: Only Chunky films can be recovered")
+		sys.exit(1)
+
+	with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+		# The size of the FILM atom is the offset of the film data.  Fall
+		# back to the end of the descriptions if it is damaged too, as the
+		# scan will skip over whatever is left of the chunk table.
+		tableOffset = 16 + film.frameDesc.getSize() + film.audioDesc.getSize()
+		dataOffset = film.headerSize
+		if dataOffset < tableOffset or dataOffset > len(mm):
+			print("WARNING: Invalid film header size, scanning from the end of the film descriptions")
+			dataOffset = tableOffset
+
+		# Check the recovered chunks against what is left of the old chunk
+		# table, if its header is intact.
+		oldOffsets = None
+		timescale = None
+		if mm[tableOffset:tableOffset + 4] == b'CTAB':
+			(timescale, count) = numpy.frombuffer(mm[tableOffset + 8:tableOffset + 16], dtype='>u4').tolist()
+			count = min(count, max(dataOffset - tableOffset - 16, 0) // 16)
+			oldRecords = numpy.frombuffer(mm[tableOffset + 16:tableOffset + 16 + count * 16], dtype='>u4').reshape(count, 4)
+			oldOffsets = set((oldRecords[:, 0].astype(numpy.int64) + dataOffset).tolist())
+			if timescale == 0:
+				timescale = None
+
+		(chunks, timescale) = findChunks(mm, dataOffset, timescale)
+
+	if len(chunks) == 0:
+		print("ERROR: No chunks found, can't recover film")
+		sys.exit(1)
+
+	chunkRecords = [ChunkRec(start=0, size=size, time=time, syncPattern=syncPattern) for (offset, size, time, syncPattern) in chunks]
+	film.chunkTable = ChunkTable(timescale=timescale, chunkRecords=chunkRecords)
+	film.type = 'Chunky'
+
+	# Chunk starts are relative to the data offset implied by the new chunk
+	# table, which may not be where the data really starts.  They are only
+	# used to find chunks in this file, so they may even be negative.
+	for (cRec, chunk) in zip(chunkRecords, chunks):
+		cRec.start = chunk[0] - film.getDataOffset()
+
+	print("Recovered " + str(len(chunks)) + " chunks")
+	if oldOffsets != None:
+		bad = len(oldOffsets - set(chunk[0] for chunk in chunks))
+		print("Chunk table listed " + str(len(oldOffsets)) + " chunks, " + str(bad) + " of them at invalid offsets")
+
+	return film
+
+# Films wrapped in AIFF, track and disc image files
+#
+# Films are found by their FILM atom followed by an FDSC atom, rather than
+# by parsing the wrappers around them, so the same scan works for AIFF
+# files, track files and whole disc images, and for films that were never
+# wrapped at all.  Rips of Jaguar CDs often have the bytes of each 16-bit
+# word swapped, as the data is burned as audio, so byte-swapped films are
+# found and read as well.
+TRACK_HEADER_TAG = b'ATARI APPROVED DATA HEADER ATRI'
+
+def swapBytes(data):
+	return numpy.frombuffer(data, dtype='<u2').astype('>u2').tobytes()
+
+class ContainerView:
+	# A read-only file-like view of a film inside a memory-mapped file,
+	# undoing byte swapping as data is read.  Films are read in place
+	# through this, without copying them out of the file first.  Swapped
+	# 16-bit words are assumed to start at even offsets in the file.
+	def __init__(self, mm, offset, size, swapped=False):
+		self.mm = mm
+		self.offset = offset
+		self.size = size
+		self.swapped = swapped
+		self.pos = 0
+
+	def seek(self, pos, whence=0):
+		if whence == 1:
+			pos += self.pos
+		elif whence == 2:
+			pos += self.size
+		self.pos = max(pos, 0)
+
+		return self.pos
+
+	def tell(self):
+		return self.pos
+
+	def peek(self, size=1):
+		start = self.offset + self.pos
+		end = self.offset + min(self.pos + size, self.size)
+
+		if start >= end:
+			return b''
+
+		if not self.swapped:
+			return self.mm[start:end]
+
+		# Swap whole words, then trim to the bytes asked for
+		wordStart = start & ~1
+		wordEnd = min((end + 1) & ~1, len(self.mm))
+		data = swapBytes(self.mm[wordStart:wordEnd] + bytes((wordEnd - wordStart) & 1))
+
+		return data[start - wordStart:end - wordStart]
+
+	def read(self, size=-1):
+		if size < 0:
+			size = self.size - self.pos
+
+		data = self.peek(size)
+		self.pos += len(data)
+
+		return data
+
+def getEmbeddedTrackNumber(mm, offset, swapped):
+	# The Atari track header is followed by the AIFF header and leader, so
+	# look for it a little way before the film.
+	start = max(offset - AIFF_HEADER_SIZE - AIFF_LEADER_SIZE - AIFF_SYNC_DATA_SIZE - TRACK_HEADER_SIZE - 0x100, 0)
+	view = ContainerView(mm, start & ~1, offset - (start & ~1), swapped)
+	window = view.read()
+
+	tagOffset = window.rfind(TRACK_HEADER_TAG)
+	if tagOffset < 0 or tagOffset + len(TRACK_HEADER_TAG) >= len(window):
+		return None
+
+	return window[tagOffset + len(TRACK_HEADER_TAG)] - 0x20
+
+def findEmbeddedFilms(mm):
+	# Returns (offset, swapped) for each film found in mm
+	films = []
+
+	for (filmTag, fdscTag, swapped) in ((b'FILM', b'FDSC', False), (b'IFML', b'DFCS', True)):
+		offset = mm.find(filmTag)
+
+		while offset >= 0:
+			if mm[offset + 16:offset + 20] == fdscTag and (not swapped or offset % 2 == 0):
+				films.append((offset, swapped))
+			offset = mm.find(filmTag, offset + 4)
+
+	return sorted(films)
+
+def fixEmbeddedFilm(containerFile, offset, size, swapped, outputFile, policy=None, toChunky=False, verbose=False):
+	with open(containerFile, "rb") as fIn, mmap.mmap(fIn.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+		view = ContainerView(mm, offset, size, swapped)
+		film = Film(f=view)
+		vs = VidState(film, view, verbose)
+		fixedFilm = getFixedFilm(film, vs, policy, toChunky)
+
+		with open(outputFile, "wb") as cpkOut:
+			fixedFilm.writeHeader(cpkOut)
+			vs.writeFixedData(fixedFilm, cpkOut)
+
+	return outputFile
+
+def getClashingNames(names):
+	# Returns the positions of the names that appear more than once
+	counts = {}
+	for name in names:
+		counts[name] = counts.get(name, 0) + 1
+
+	return [i for i in range(len(names)) if counts[names[i]] > 1]
+
+def getUniqueScanNames(inputFiles, names):
+	# Films in different input files can end up with the same name, like
+	# the tracks of two discs whose images are both called game.bin.  They
+	# are told apart by the directory their input file is in, and failing
+	# that, by numbering them.
+	names = list(names)
+
+	for i in getClashingNames(names):
+		parent = os.path.basename(os.path.dirname(os.path.abspath(inputFiles[i])))
+		names[i] = parent + '-' + names[i]
+
+	clashes = getClashingNames(names)
+	while len(clashes) > 0:
+		numbers = {}
+		for i in clashes:
+			numbers[names[i]] = numbers.get(names[i], 0) + 1
+			(stem, ext) = os.path.splitext(names[i])
+			names[i] = stem + '-' + str(numbers[names[i]]) + ext
+
+		clashes = getClashingNames(names)
+
+	return names
+
+def scanFilms(args):
+	jobs = []
+	inputFiles = []
+	names = []
+
+	for inputFile in args.input_file:
+		stem = os.path.splitext(os.path.basename(inputFile))[0]
+		filmNumber = 0
+
+		with open(inputFile, "rb") as fIn, mmap.mmap(fIn.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+			found = findEmbeddedFilms(mm)
+
+			# A film can't hold another one, so any match inside a film
+			# found earlier is just sample data that happens to look
+			# like a film header.
+			filmEnd = 0
+
+			for (offset, swapped) in found:
+				if offset < filmEnd:
+					continue
+
+				film = Film(f=ContainerView(mm, offset, len(mm) - offset, swapped))
+				size = getFilmSize(film)
+				filmEnd = offset + size
+
+				if filmEnd > len(mm):
+					print("WARNING: Film at " + hex(offset) + " in " + inputFile + " is truncated, skipping it")
+					continue
+
+				trackNumber = getEmbeddedTrackNumber(mm, offset, swapped)
+				if trackNumber != None:
+					name = stem + '-t{:02d}.crg'.format(trackNumber)
+				else:
+					filmNumber += 1
+					name = stem + '-' + str(filmNumber) + '.crg'
+
+				if swapped:
+					layout = " (byte swapped)"
+				else:
+					layout = ""
+
+				print("Found film at " + hex(offset) + " in " + inputFile + layout + ", " + str(size) + " bytes")
+				jobs.append((inputFile, offset, size, swapped))
+				inputFiles.append(inputFile)
+				names.append(name)
+
+	if len(jobs) == 0:
+		print("ERROR: No films found")
+		sys.exit(1)
+
+	# Every worker must write to a file of its own
+	names = getUniqueScanNames(inputFiles, names)
+	jobs = [job + (os.path.join(args.scan, name),) for (job, name) in zip(jobs, names)]
+
+	os.makedirs(args.scan, exist_ok=True)
+
+	# Workers may be forked, and would print anything still buffered again
+	sys.stdout.flush()
+
+	with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+		futures = [executor.submit(fixEmbeddedFilm, *job, createChunkPolicy(args), args.to_chunky, args.verbose) for job in jobs]
+
+		for future in futures:
+			print("Wrote fixed film " + future.result())
+
+# Catalog of the films in a library of files
+#
+# The catalog is a SQLite database with a row per file, holding the size
+# and modification time it had when it was scanned, and a row per film
+# found in those files.  Only files that are new or whose size or
+# modification time changed are scanned again, so keeping the catalog up
+# to date is cheap, and questions about the whole library become queries.
+CATALOG_EXTENSIONS = ('.crg', '.cpk', '.film', '.aif', '.aiff', '.bin', '.img')
+
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+	path TEXT PRIMARY KEY,
+	size INTEGER,
+	mtime INTEGER,
+	error TEXT
+);
+CREATE TABLE IF NOT EXISTS films (
+	path TEXT,
+	offset INTEGER,
+	swapped INTEGER,
+	track INTEGER,
+	type TEXT,
+	compression TEXT,
+	width INTEGER,
+	height INTEGER,
+	channels INTEGER,
+	bits INTEGER,
+	signed INTEGER,
+	audio_compression TEXT,
+	sclk INTEGER,
+	drift_rate INTEGER,
+	sample_rate REAL,
+	timescale INTEGER,
+	size INTEGER,
+	duration REAL,
+	chunks INTEGER,
+	samples INTEGER,
+	video_samples INTEGER,
+	audio_samples INTEGER,
+	in_sync INTEGER,
+	desync_time REAL,
+	min_chunk_size INTEGER,
+	max_chunk_size INTEGER,
+	mean_chunk_size REAL,
+	PRIMARY KEY (path, offset)
+);
+"""
+
+CATALOG_FILM_COLUMNS = ('path', 'offset', 'swapped', 'track', 'type', 'compression', 'width', 'height', 'channels', 'bits', 'signed', 'audio_compression', 'sclk', 'drift_rate', 'sample_rate', 'timescale', 'size', 'duration', 'chunks', 'samples', 'video_samples', 'audio_samples', 'in_sync', 'desync_time', 'min_chunk_size', 'max_chunk_size', 'mean_chunk_size')
+
+def isCatalogFile(fileName):
+	(stem, ext) = os.path.splitext(fileName.lower())
+	return ext in CATALOG_EXTENSIONS or (len(ext) == 4 and ext[1] == 't' and ext[2:].isdigit())
+
+def getCatalogFiles(paths):
+	files = []
+
+	for path in paths:
+		if os.path.isdir(path):
+			for (dirPath, dirNames, fileNames) in os.walk(path):
+				dirNames.sort()
+				for fileName in sorted(fileNames):
+					if isCatalogFile(fileName):
+						files.append(os.path.abspath(os.path.join(dirPath, fileName)))
+		else:
+			files.append(os.path.abspath(path))
+
+	return files
+
+def getFilmRecord(path, mm, offset, swapped):
+	view = ContainerView(mm, offset, len(mm) - offset, swapped)
+	film = Film(f=view)
+	index = SampleIndex(film=film, f=view)
+	vs = VidState(film, view, index=index)
+	video = ~index.audio
+	timescale = film.getTimescale()
+
+	# A film is in sync if its samples are already in the order the fix
+	# would put them in.  Audio pre-buffered past the end of the video is
+	# dropped by the fix, so only the samples the fix keeps are compared.
+	(order, times) = vs.getFixedSampleOrder()
+	order = numpy.array(order, dtype=numpy.int64)
+	misplaced = numpy.flatnonzero(order != numpy.arange(len(order)))
+	if len(misplaced) > 0:
+		desync = int(misplaced[0])
+		desyncTime = float(index.durations[:desync][video[:desync]].sum()) / timescale
+	else:
+		desyncTime = None
+
+	if film.isChunky() and len(film.chunkTable.chunkRecords) > 0:
+		chunkSizes = numpy.array([cRec.size for cRec in film.chunkTable.chunkRecords], dtype=numpy.int64)
+		chunkStats = (int(chunkSizes.min()), int(chunkSizes.max()), float(chunkSizes.mean()))
+		chunkCount = len(chunkSizes)
+	else:
+		chunkStats = (None, None, None)
+		chunkCount = 0
+
+	audioDesc = film.audioDesc
+
+	return (path, offset, int(swapped), getEmbeddedTrackNumber(mm, offset, swapped), film.type,
+		film.frameDesc.compressionType.decode('ascii', 'replace'), film.frameDesc.width, film.frameDesc.height,
+		audioDesc.getChannelCount(), audioDesc.bits, audioDesc.signed, audioDesc.compression,
+		audioDesc.sclk, audioDesc.driftRate, audioDesc.sampleRate, timescale, getFilmSize(film),
+		float(index.durations[video].sum()) / timescale, chunkCount, len(index), int(video.sum()),
+		int(index.audio.sum()), int(desyncTime == None), desyncTime) + chunkStats
+
+def scanCatalogFile(path):
+	# Runs in a worker process.  Returns the identity of the file, the
+	# catalog records of the films in it, and any error that stopped the
+	# scan.  Everything printed while reading the films is dropped, but is
+	# kept as the error if reading one of them fails.
+	st = os.stat(path)
+	records = []
+	error = None
+	output = io.StringIO()
+
+	try:
+		with redirect_stdout(output):
+			if st.st_size > 0:
+				with open(path, "rb") as fIn, mmap.mmap(fIn.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+					filmEnd = 0
+					for (offset, swapped) in findEmbeddedFilms(mm):
+						if offset < filmEnd:
+							continue
+						record = getFilmRecord(path, mm, offset, swapped)
+						records.append(record)
+						filmEnd = offset + record[CATALOG_FILM_COLUMNS.index('size')]
+	except (SystemExit, Exception) as e:
+		lines = output.getvalue().strip().splitlines()
+		if len(lines) > 0:
+			error = lines[-1]
+		else:
+			error = repr(e)
+
+	return (path, st.st_size, st.st_mtime_ns, records, error)
+
+def updateCatalog(args):
+	db = sqlite3.connect(args.catalog)
+	db.executescript(CATALOG_SCHEMA)
+
+	known = dict((row[0], (row[1], row[2])) for row in db.execute("SELECT path, size, mtime FROM files"))
+	paths = getCatalogFiles(args.input_file)
+
+	# Forget files that have gone away
+	gone = [path for path in known if not os.path.exists(path)]
+	with db:
+		for path in gone:
+			db.execute("DELETE FROM files WHERE path = ?", (path,))
+			db.execute("DELETE FROM films WHERE path = ?", (path,))
+
+	changed = []
+	for path in paths:
+		st = os.stat(path)
+		if known.get(path) != (st.st_size, st.st_mtime_ns):
+			changed.append(path)
+
+	print("Scanning " + str(len(changed)) + " of " + str(len(paths)) + " files")
+
+	# Workers may be forked, and would print anything still buffered again
+	sys.stdout.flush()
+
+	filmCount = 0
+	with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+		for (path, size, mtime, records, error) in executor.map(scanCatalogFile, changed, chunksize=4):
+			with db:
+				db.execute("DELETE FROM films WHERE path = ?", (path,))
+				db.executemany("INSERT INTO films (" + ", ".join(CATALOG_FILM_COLUMNS) + ") VALUES (" + ", ".join("?" * len(CATALOG_FILM_COLUMNS)) + ")", records)
+				db.execute("INSERT OR REPLACE INTO files (path, size, mtime, error) VALUES (?, ?, ?, ?)", (path, size, mtime, error))
+
+			filmCount += len(records)
+			if error != None:
+				print("WARNING: " + path + ": " + error)
+			elif args.verbose:
+				print(path + ": " + str(len(records)) + " films")
+
+	(total, broken) = db.execute("SELECT COUNT(*), COUNT(*) - COALESCE(SUM(in_sync), 0) FROM films").fetchone()
+	print("Found " + str(filmCount) + " films in scanned files, catalog holds " + str(total) + " films, " + str(broken) + " out of sync")
+
+	db.close()
+
+def createProgress(args):
+	if args.progress == None:
+		return None
+
+	if args.progress_file == None or args.progress_file == '-':
+		stream = sys.stderr
+	else:
+		stream = open(args.progress_file, "a")
+
+	if args.progress == 'json':
+		reporter = ProgressJsonStream(stream)
+	else:
+		reporter = ProgressBar(stream)
+
+	return Progress(reporters=[reporter])
+
+def createChunkPolicy(args):
+	return ChunkPolicy(chunkDuration=args.chunk_duration, maxChunkSize=args.max_chunk_size, cdSpeed=args.cd_speed)
+
+def simulateFilms(args):
+	if args.cd_speed != None:
+		cdSpeed = args.cd_speed
+	else:
+		cdSpeed = 2
+
+	for inputFile in args.input_file:
+		with open(inputFile, "rb") as cpkIn:
+			film = Film(f=cpkIn)
+			index = SampleIndex(film=film, f=cpkIn)
+
+		print("Simulating playback of " + inputFile + " at " + str(cdSpeed) + "x")
+		simulator = PlaybackSimulator(film, index, cdSpeed=cdSpeed, audioBufferSize=args.audio_buffer_size, videoBufferSize=args.video_buffer_size)
+		report = simulator.run()
+		report.printReport()
+
+		if not report.isPlayable():
+			print("ERROR: " + inputFile + " will not play back cleanly at " + str(cdSpeed) + "x")
+
+def getPrerollReport(vs, policy, audioLead, cdSpeed, audioBufferSize=None, videoBufferSize=None):
+	vs.setAudioLead(audioLead)
+	fixedFilm = Film(frameDesc=vs.film.frameDesc, audioDesc=vs.film.audioDesc, chunkTable=vs.getFixedChunkTable(policy))
+	simulator = PlaybackSimulator(fixedFilm, vs.getFixedSampleIndex(fixedFilm), cdSpeed=cdSpeed, audioBufferSize=audioBufferSize, videoBufferSize=videoBufferSize)
+
+	return simulator.run()
+
+def optimizeAudioLead(vs, policy, args):
+	# Finds the smallest audio lead that never lets the audio buffer run
+	# dry when the fixed film is played from a drive at --cd-speed.  Less
+	# audio ahead of the video makes the first chunk smaller, so the first
+	# frame comes up sooner.  Too little lead starves the audio buffer, but
+	# with --audio-buffer-size too much lead overfills it and the audio
+	# that doesn't fit runs short later, so only leads in some window
+	# work.  Leads are tried going up from 0 until one works, and only the
+	# last step before it is narrowed down with a binary search.
+	if args.cd_speed != None:
+		cdSpeed = args.cd_speed
+	else:
+		cdSpeed = 2
+
+	film = vs.film
+	timescale = film.getTimescale()
+	index = vs.getIndex()
+
+	# Plan quietly on a copy, with the chunk sizes the policy would allow
+	# but without it reporting on every plan.
+	chunkDuration = policy.getChunkDuration(film)
+	policy = ChunkPolicy(chunkDuration=chunkDuration, maxChunkSize=policy.getMaxChunkSize(chunkDuration, timescale))
+	searchVs = VidState(film, vs.file, index=index, files=vs.files, audioSource=vs.audioSource)
+
+	def isPlayable(audioLead):
+		return len(getPrerollReport(searchVs, policy, audioLead, cdSpeed, args.audio_buffer_size, args.video_buffer_size).audioUnderruns) == 0
+
+	audio = numpy.flatnonzero(index.audio)
+	if len(audio) > 0:
+		defaultLead = float(index.sizes[audio[0]]) / film.audioDesc.sampleRate * timescale / 2.0
+	else:
+		defaultLead = 0.0
+	defaultReport = getPrerollReport(searchVs, policy, None, cdSpeed, args.audio_buffer_size, args.video_buffer_size)
+
+	# There's no point going past the default lead if that works
+	if len(defaultReport.audioUnderruns) == 0:
+		limit = defaultLead
+	else:
+		limit = max(2.0 * timescale, defaultLead)
+
+	step = timescale / 20.0
+	leads = [i * step for i in range(int(limit / step) + 1) if i * step < limit] + [limit]
+
+	low = None
+	high = None
+	for lead in leads:
+		if isPlayable(lead):
+			high = lead
+			break
+		low = lead
+
+	if high == None:
+		if len(defaultReport.audioUnderruns) == 0:
+			return None
+
+		print("WARNING: The audio buffer runs dry at " + str(cdSpeed) + "x with the default audio lead, and with any audio lead up to " + str(limit / timescale) + "s, keeping the default audio lead")
+		return None
+
+	if low == None:
+		low = high
+
+	while high - low > timescale / 1000.0:
+		mid = (low + high) / 2.0
+		if isPlayable(mid):
+			high = mid
+		else:
+			low = mid
+
+	report = getPrerollReport(searchVs, policy, high, cdSpeed, args.audio_buffer_size, args.video_buffer_size)
+
+	print("Audio lead: {:.3f}s, default {:.3f}s".format(high / timescale, defaultLead / timescale))
+	print("Time to first frame at {}x: {:.3f}s, default {:.3f}s, {:.3f}s faster".format(cdSpeed, report.startTime, defaultReport.startTime, defaultReport.startTime - report.startTime))
+	if len(defaultReport.audioUnderruns) > 0:
+		print("The default audio lead lets the audio buffer run dry " + str(len(defaultReport.audioUnderruns)) + " times")
+
+	return high
+
+def extractClips(args):
+	progress = createProgress(args)
+
+	with open(args.input_file[0], "rb") as cpkIn:
+		film = Film(f=cpkIn)
+
+		if not film.isChunky():
+			print("ERROR: Clips can only be extracted from Chunky films")
+			sys.exit(1)
+
+		cache = ChunkCache(film, cpkIn)
+		timescale = film.getTimescale()
+
+		# A clip starting after the last frame would otherwise get the
+		# frames from the last sync frame on.
+		lastChunk = cache.getChunkCount() - 1
+		lastIndex = cache.getChunkIndex(lastChunk)
+		filmEnd = film.chunkTable.chunkRecords[lastChunk].time + int(lastIndex.durations[~lastIndex.audio].sum())
+
+		for (start, end, clipFile) in args.clip:
+			startTime = int(float(start) * timescale)
+			endTime = int(float(end) * timescale)
+
+			if endTime <= startTime:
+				print("ERROR: The clip " + clipFile + " ends before it starts")
+				sys.exit(1)
+
+			clipIndex = getClipIndex(film, cache, startTime, endTime)
+			if startTime >= filmEnd or (~clipIndex.audio).sum() == 0:
+				print("ERROR: The clip " + clipFile + " from " + start + "s to " + end + "s has no video frames in the film")
+				sys.exit(1)
+
+			vs = VidState(film, cpkIn, args.verbose, index=clipIndex)
+			clipFilm = getFixedFilm(film, vs, createChunkPolicy(args))
+
+			print("Writing clip " + clipFile + " from " + start + "s to " + end + "s")
+
+			with open(clipFile, "wb") as clipOut:
+				clipFilm.writeHeader(clipOut)
+
+				if progress != None:
+					progress.start("clip", totalBytes=getFilmSize(clipFilm) - clipFilm.getDataOffset())
+
+				vs.writeFixedData(clipFilm, clipOut, progress)
+
+				if progress != None:
+					progress.finish()
+
+def writeFixedFilmFile(vs, fixedFilm, fileName, args, progress):
+	(order, times) = vs.getFixedSampleOrder()
+	journal = FixJournal(fileName + ".journal", args.input_file, FixJournal.getPlanHash(fixedFilm, order, times))
+	chunkRecs = fixedFilm.chunkTable.chunkRecords
+	startChunk = 0
+
+	if args.resume:
+		startChunk = journal.load()
+
+	if startChunk > 0:
+		if startChunk < len(chunkRecs):
+			offset = fixedFilm.getDataOffset() + chunkRecs[startChunk].start
+		else:
+			offset = getFilmSize(fixedFilm)
+
+		if journal.offset != offset or not os.path.exists(fileName) or os.path.getsize(fileName) < offset:
+			print("ERROR: " + fileName + " doesn't match its checkpoint journal, can't resume")
+			sys.exit(1)
+
+		print("Resuming at chunk " + str(startChunk) + " of " + str(len(chunkRecs)))
+		cpkOut = open(fileName, "r+b")
+		cpkOut.truncate(offset)
+		cpkOut.seek(offset, 0)
+	else:
+		offset = fixedFilm.getDataOffset()
+		cpkOut = open(fileName, "wb")
+		fixedFilm.writeHeader(cpkOut)
+
+	with cpkOut:
+		if progress != None:
+			progress.start("fix", totalBytes=getFilmSize(fixedFilm) - offset)
+
+		vs.writeFixedData(fixedFilm, cpkOut, progress, startChunk, lambda chunk: journal.update(cpkOut, chunk))
+
+		if progress != None:
+			progress.finish()
+
+	journal.remove()
+
+	seekIndex = None
+	if fixedFilm.isChunky() and (args.seek_index != None or args.embed_seek_index):
+		seekIndex = vs.getFixedSeekIndex(fixedFilm)
+
+		if len(seekIndex.entries) == 0:
+			print("WARNING: No sync frames found, the seek index is empty")
+
+		if args.seek_index != None:
+			with open(args.seek_index, "wb") as sidxOut:
+				seekIndex.write(sidxOut)
+
+	return seekIndex
+
+def wrapFixedFile(args, seekIndex, progress):
+	if args.fixed_aiff_file == None:
+		return
+
+	with open(args.fixed_file, "rb") as cpkIn, open(args.fixed_aiff_file, "wb") as aifOut:
+		cpkSize = getFileSize(cpkIn)
+
+		if progress != None:
+			progress.start("aiff", totalBytes=cpkSize)
+
+		writeAiffHeader(aifOut, cpkSize)
+		copyFileData(cpkIn, aifOut, progress)
+
+		if args.embed_seek_index:
+			writeAiffTrailer(aifOut, seekIndex)
+		else:
+			writeAiffTrailer(aifOut)
+
+		if progress != None:
+			progress.finish()
+
+	if args.fixed_track_file == None:
+		return
+
+	# Wrap the AIFF-wrapped file with Jaguar CD track header/trailer
+	with open(args.fixed_aiff_file, "rb") as aifIn, open(args.fixed_track_file, "wb") as trkOut:
+		aifSize = getFileSize(aifIn)
+
+		if progress != None:
+			progress.start("track", totalBytes=aifSize)
+
+		writeTrackHeader(trkOut, args.track_number, args.leading_zero_word)
+		copyFileData(aifIn, trkOut, progress)
+		writeTrackTrailer(trkOut, args.track_number, aifSize)
+
+		if progress != None:
+			progress.finish()
+
+def decodeAudio(audioDesc, data):
+	# Decodes uncompressed Jaguar audio data into signed samples, with the
+	# channels of stereo audio interleaved.
+	if audioDesc.bits == 16:
+		if audioDesc.signed:
+			return numpy.frombuffer(data, dtype='>i2').astype(numpy.int16)
+		else:
+			return (numpy.frombuffer(data, dtype='>u2') ^ 0x8000).view(numpy.int16)
+	else:
+		if audioDesc.signed:
+			return numpy.frombuffer(data, dtype=numpy.int8)
+		else:
+			return (numpy.frombuffer(data, dtype=numpy.uint8) ^ 0x80).view(numpy.int8)
+
+def encodeAudio(audioDesc, samples):
+	# The reverse of decodeAudio()
+	if audioDesc.bits == 16:
+		if audioDesc.signed:
+			return samples.astype('>i2').tobytes()
+		else:
+			return (samples.view(numpy.uint16) ^ 0x8000).astype('>u2').tobytes()
+	else:
+		if audioDesc.signed:
+			return samples.tobytes()
+		else:
+			return (samples.view(numpy.uint8) ^ 0x80).tobytes()
+
+def encodeWavAudio(samples):
+	# WAV stores 16-bit samples signed and little-endian, and 8-bit ones
+	# unsigned.
+	if samples.dtype == numpy.int16:
+		return samples.astype('<i2').tobytes()
+	else:
+		return (samples.view(numpy.uint8) ^ 0x80).tobytes()
+
+def writeWavHeader(f, audioDesc, dataSize):
+	channels = audioDesc.getChannelCount()
+	sampleRate = int(round(audioDesc.sampleRate))
+	blockAlign = audioDesc.getFrameSize()
+
+	f.write(b'RIFF')
+	f.write((36 + dataSize).to_bytes(4, byteorder='little'))
+	f.write(b'WAVE')
+
+	f.write(b'fmt ')
+	f.write((16).to_bytes(4, byteorder='little'))
+	# PCM format
+	f.write((1).to_bytes(2, byteorder='little'))
+	f.write(channels.to_bytes(2, byteorder='little'))
+	f.write(sampleRate.to_bytes(4, byteorder='little'))
+	f.write((sampleRate * blockAlign).to_bytes(4, byteorder='little'))
+	f.write(blockAlign.to_bytes(2, byteorder='little'))
+	f.write(audioDesc.bits.to_bytes(2, byteorder='little'))
+
+	f.write(b'data')
+	f.write(dataSize.to_bytes(4, byteorder='little'))
+
+def writeAudio(film, f, index, out, wav=True, progress=None, batchSize=0x100000):
+	# Writes all the audio of a film, in stream order, as a WAV file or as
+	# the raw audio data.  Audio is read and converted in batches of about
+	# batchSize bytes, so memory use doesn't grow with the film.
+	audioDesc = film.audioDesc
+	audio = numpy.flatnonzero(index.audio)
+	offsets = index.offsets[audio].tolist()
+	sizes = index.sizes[audio].tolist()
+	totalSize = sum(sizes)
+
+	if wav:
+		if audioDesc.compression != "uncompressed":
+			print("ERROR: Only uncompressed audio can be written to a WAV file")
+			sys.exit(1)
+
+		frameSize = audioDesc.getFrameSize()
+		writeWavHeader(out, audioDesc, totalSize // frameSize * frameSize)
+	else:
+		frameSize = 1
+
+	if progress != None:
+		progress.start("audio", totalBytes=totalSize, totalSamples=len(sizes))
+
+	pending = b''
+	batch = []
+	batchBytes = 0
+
+	for i in range(len(sizes) + 1):
+		if i < len(sizes):
+			f.seek(offsets[i], 0)
+			batch.append(f.read(sizes[i]))
+			batchBytes += sizes[i]
+
+			if batchBytes < batchSize:
+				continue
+
+		# Only whole sample frames are converted, with any partial frame
+		# carried over to the next batch
+		data = pending + b''.join(batch)
+		wholeSize = len(data) // frameSize * frameSize
+		pending = data[wholeSize:]
+
+		if wav:
+			out.write(encodeWavAudio(decodeAudio(audioDesc, data[:wholeSize])))
+		else:
+			out.write(data[:wholeSize])
+
+		if progress != None:
+			progress.update(batchBytes, len(batch))
+
+		batch = []
+		batchBytes = 0
+
+	if progress != None:
+		progress.finish()
+
+class AudioResampler:
+	# Linearly resamples the audio of a film to the sample rate of
+	# audioDesc.  The resampled audio keeps the same number of audio
+	# samples, each covering the same stretch of the input audio, so the
+	# size of every resampled sample is known before any audio is read.
+	#
+	# Audio is decoded and resampled a sample at a time as read() is
+	# called.  Only the input frames around the samples being read are kept,
+	# so memory use doesn't grow with the film.  Samples are expected to be
+	# read in stream order, but reading any other one works too, just more
+	# slowly.
+	def __init__(self, film, f, index, audioDesc):
+		self.file = f
+		self.inDesc = film.audioDesc
+		self.outDesc = audioDesc
+		self.ratio = audioDesc.sampleRate / film.audioDesc.sampleRate
+		self.frameSize = film.audioDesc.getFrameSize()
+		self.channels = film.audioDesc.getChannelCount()
+
+		# Index positions of the audio samples, in stream order
+		self.audio = numpy.flatnonzero(index.audio)
+		self.offsets = index.offsets[self.audio].tolist()
+		self.inSizes = index.sizes[self.audio].tolist()
+		# The audio is one stream, so frames may be split between samples
+		self.inByteEnds = numpy.cumsum(index.sizes[self.audio])
+		self.inEnds = self.inByteEnds // self.frameSize
+		self.outEnds = numpy.floor(self.inEnds * self.ratio).astype(numpy.int64)
+
+		self._seekInput(0)
+
+	def getSizes(self):
+		# Returns the size of each resampled audio sample, in stream order
+		return numpy.diff(self.outEnds, prepend=0) * self.frameSize
+
+	def _seekInput(self, k):
+		# Restart decoding at the kth audio sample of the input, starting
+		# with the part of any frame split between it and the one before.
+		self.nextInput = k
+		self.bufStart = int(self.inEnds[k - 1]) if k > 0 else 0
+		self.buf = numpy.zeros((0, self.channels))
+		self.pending = b''
+
+		if k > 0:
+			tailSize = int(self.inByteEnds[k - 1]) % self.frameSize
+			if tailSize > 0:
+				self.file.seek(self.offsets[k - 1] + self.inSizes[k - 1] - tailSize, 0)
+				self.pending = self.file.read(tailSize)
+
+	def _fill(self, endFrame):
+		# Decode input audio until frame endFrame - 1 is in the buffer, or
+		# the audio runs out.
+		pieces = [self.buf]
+		bufEnd = self.bufStart + len(self.buf)
+
+		while bufEnd < endFrame and self.nextInput < len(self.offsets):
+			self.file.seek(self.offsets[self.nextInput], 0)
+			data = self.pending + self.file.read(self.inSizes[self.nextInput])
+			wholeSize = len(data) // self.frameSize * self.frameSize
+			self.pending = data[wholeSize:]
+			frames = decodeAudio(self.inDesc, data[:wholeSize]).reshape(-1, self.channels)
+			pieces.append(frames)
+			bufEnd += len(frames)
+			self.nextInput += 1
+
+		self.buf = numpy.concatenate(pieces).astype(numpy.float64)
+
+	def read(self, i):
+		k = int(numpy.searchsorted(self.audio, i))
+		outStart = int(self.outEnds[k - 1]) if k > 0 else 0
+		outEnd = int(self.outEnds[k])
+
+		if outEnd <= outStart:
+			return b''
+
+		# The input frames each output frame falls between
+		x = numpy.arange(outStart, outEnd) / self.ratio
+		x0 = numpy.floor(x).astype(numpy.int64)
+		frac = (x - x0)[:, numpy.newaxis]
+
+		first = int(x0[0])
+		if first < self.bufStart or first > self.bufStart + len(self.buf) + 0x10000:
+			self._seekInput(int(numpy.searchsorted(self.inEnds, first, side='right')))
+
+		self._fill(int(x0[-1]) + 2)
+
+		# Drop the frames no later sample needs
+		if first > self.bufStart:
+			self.buf = self.buf[first - self.bufStart:]
+			self.bufStart = first
+
+		last = len(self.buf) - 1
+		s0 = self.buf[numpy.minimum(x0 - self.bufStart, last)]
+		s1 = self.buf[numpy.minimum(x0 + 1 - self.bufStart, last)]
+		y = numpy.rint(s0 + (s1 - s0) * frac)
+
+		if self.outDesc.bits == 16:
+			samples = numpy.clip(y, -0x8000, 0x7FFF).astype(numpy.int16)
+		else:
+			samples = numpy.clip(y, -0x80, 0x7F).astype(numpy.int8)
+
+		return encodeAudio(self.outDesc, samples.reshape(-1))
+
+def getResampledFilm(film, f, index, sclk):
+	# Returns a film with its audio description changed to the new SCLK,
+	# an index with the new audio sample sizes, and a resampler providing
+	# the new audio data.
+	audioDesc = film.audioDesc
+
+	if audioDesc.compression != "uncompressed":
+		print("ERROR: Only uncompressed audio can be resampled")
+		sys.exit(1)
+
+	newDesc = AudioDescription(channels=audioDesc.channels, bits=audioDesc.bits, compression=audioDesc.compression, signed=audioDesc.signed, sclk=sclk, driftRate=audioDesc.driftRate, videoClock=audioDesc.videoClock)
+	newFilm = Film(frameDesc=film.frameDesc, audioDesc=newDesc, chunkTable=film.chunkTable, sampleTable=film.sampleTable)
+
+	resampler = AudioResampler(film, f, index, newDesc)
+	newIndex = index.subset(numpy.arange(len(index)))
+	newIndex.sizes[resampler.audio] = resampler.getSizes()
+	newIndex.fileIds[resampler.audio] = -1
+
+	oldBytes = int(index.sizes[index.audio].sum())
+	newBytes = int(newIndex.sizes[newIndex.audio].sum())
+	print("Resampling audio from " + str(audioDesc.sampleRate) + " Hz to " + str(newDesc.sampleRate) + " Hz, " + str(oldBytes) + " bytes to " + str(newBytes) + " bytes")
+
+	return (newFilm, newIndex, resampler)
+
+def extractAudio(args):
+	progress = createProgress(args)
+
+	with open(args.input_file[0], "rb") as cpkIn, open(args.extract_audio, "wb") as audOut:
+		film = Film(f=cpkIn)
+		index = SampleIndex(film=film, f=cpkIn)
+
+		print("Writing audio to " + args.extract_audio)
+		writeAudio(film, cpkIn, index, audOut, args.audio_format == 'wav', progress)
+
+def writeFixedPatchFile(vs, fixedFilm, args):
+	inputSizes = [os.path.getsize(inputFile) for inputFile in args.input_file]
+
+	print("Writing reorder patch to " + args.patch_file)
+
+	with open(args.patch_file, "wb") as patchOut:
+		moveCount = writeFixedPatch(vs, fixedFilm, patchOut, inputSizes)
+		patchSize = patchOut.tell()
+
+	print("Patch size: " + str(patchSize) + " bytes, " + str(moveCount) + " moves, for a " + str(getFilmSize(fixedFilm)) + " byte film")
+
+def applyPatch(args):
+	progress = createProgress(args)
+	files = [open(inputFile, "rb") for inputFile in args.input_file]
+
+	try:
+		# The ops are only new headers and copies, so they're all read up
+		# front to find what to check the input films against.
+		with open(args.apply_patch, "rb") as patchIn:
+			reader = PatchReader(patchIn)
+			ops = list(reader.ops())
+
+		if len(reader.inputSizes) != len(files):
+			print("ERROR: Reorder patch needs " + str(len(reader.inputSizes)) + " input films, got " + str(len(files)))
+			sys.exit(1)
+
+		moves = [op[1:] for op in ops if op[0] == 'MOVE']
+		for (fileId, offset, size) in moves:
+			if fileId >= len(files):
+				print("ERROR: Invalid input film number in reorder patch file")
+				sys.exit(1)
+
+		for i in range(len(files)):
+			if os.path.getsize(args.input_file[i]) == reader.inputSizes[i]:
+				starts = [offset for (fileId, offset, size) in moves if fileId == i]
+				sizes = [size for (fileId, offset, size) in moves if fileId == i]
+				digest = getInputDigest(files[i], reader.inputSizes[i], starts, sizes)
+			else:
+				digest = None
+
+			if digest != reader.inputDigests[i]:
+				print("ERROR: " + args.input_file[i] + " is not the film this reorder patch was made from")
+				sys.exit(1)
+
+		print("Applying reorder patch " + args.apply_patch + " to " + args.fixed_file)
+
+		with open(args.fixed_file, "wb", buffering=0) as cpkOut:
+			if progress != None:
+				progress.start("patch", totalBytes=reader.outputSize)
+
+			for op in ops:
+				if op[0] == 'DATA':
+					writeAll(cpkOut, op[1])
+					if progress != None:
+						progress.update(len(op[1]))
+				else:
+					(fileId, offset, size) = op[1:]
+					copyFileRange(files[fileId], cpkOut, offset, size, progress)
+
+			if cpkOut.tell() != reader.outputSize:
+				print("ERROR: Patched film is " + str(cpkOut.tell()) + " bytes, expected " + str(reader.outputSize))
+				sys.exit(1)
+
+			if progress != None:
+				progress.finish()
+	finally:
+		for f in files:
+			f.close()
+
+	wrapFixedFile(args, None, progress)
+
+def getJoinMismatch(film, other):
+	# Returns what stops two films from being joined, or None if they can be
+	fields = [
+		("compression type", film.frameDesc.compressionType, other.frameDesc.compressionType),
+		("width", film.frameDesc.width, other.frameDesc.width),
+		("height", film.frameDesc.height, other.frameDesc.height),
+		("timescale", film.getTimescale(), other.getTimescale()),
+		("audio channels", film.audioDesc.channels, other.audioDesc.channels),
+		("audio sample size", film.audioDesc.bits, other.audioDesc.bits),
+		("audio compression", film.audioDesc.compression, other.audioDesc.compression),
+		("audio signedness", film.audioDesc.signed, other.audioDesc.signed),
+		("audio SCLK", film.audioDesc.sclk, other.audioDesc.sclk),
+		("audio drift rate", film.audioDesc.driftRate, other.audioDesc.driftRate),
+	]
+
+	for (name, value, otherValue) in fields:
+		if value != otherValue:
+			return name
+
+	return None
+
+def getJoinIndex(film, index):
+	# Cuts or pads the audio of a film to the length of its video, so the
+	# audio of the film joined after it starts in sync with its video.
+	audioDesc = film.audioDesc
+	frameSize = audioDesc.getFrameSize()
+	videoSeconds = index.durations[~index.audio].sum() / float(film.getTimescale())
+	audioLimit = int(videoSeconds * audioDesc.getBytesPerSecond()) // frameSize * frameSize
+
+	audio = index.subset(numpy.flatnonzero(index.audio))
+	starts = numpy.cumsum(audio.sizes) - audio.sizes
+	audio = audio.subset(numpy.flatnonzero(starts < audioLimit))
+	starts = starts[starts < audioLimit]
+
+	if audioDesc.compression == "uncompressed":
+		audio.sizes = numpy.minimum(audio.sizes, audioLimit - starts)
+
+	indexes = [audio]
+
+	missing = audioLimit - int(audio.sizes.sum())
+	if missing > 0 and audioDesc.compression == "uncompressed":
+		if len(audio) > 0:
+			pieceSize = int(numpy.median(audio.sizes)) // frameSize * frameSize
+		else:
+			pieceSize = 0x1000
+		pieceSize = max(pieceSize, frameSize)
+
+		sizes = numpy.full(missing // pieceSize, pieceSize, dtype=numpy.int64)
+		if missing % pieceSize:
+			sizes = numpy.append(sizes, missing % pieceSize)
+
+		count = len(sizes)
+		indexes.append(SampleIndex(offsets=numpy.zeros(count, dtype=numpy.int64), sizes=sizes, times=numpy.full(count, 0x7FFFFFFF, dtype=numpy.int64), syncs=numpy.zeros(count, dtype=numpy.int64), durations=numpy.zeros(count, dtype=numpy.int64), chunks=numpy.full(count, -1, dtype=numpy.int64), fileIds=numpy.full(count, -1, dtype=numpy.int64)))
+	elif missing > 0:
+		print("WARNING: Compressed audio can't be padded, audio after the join will be early")
+
+	video = index.subset(numpy.flatnonzero(~index.audio))
+	indexes.append(video)
+
+	return SampleIndex(indexes=indexes)
+
+def concatFilms(args):
+	progress = createProgress(args)
+	inputFiles = args.input_file
+	files = [open(inputFile, "rb") for inputFile in inputFiles]
+
+	try:
+		films = [Film(f=f) for f in files]
+
+		# The interleave times every audio sample as if it were 8-bit mono,
+		# so the audio of any other film would run long and be cut short.
+		for i in range(len(films)):
+			if films[i].audioDesc.getFrameSize() != 1:
+				print("ERROR: " + inputFiles[i] + " can't be joined, only films with 8-bit mono audio can be")
+				sys.exit(1)
+
+		for i in range(1, len(films)):
+			mismatch = getJoinMismatch(films[0], films[i])
+			if mismatch != None:
+				print("ERROR: " + inputFiles[i] + " can't be joined to " + inputFiles[0] + ", the " + mismatch + " is different")
+				sys.exit(1)
+
+		indexes = []
+		for i in range(len(films)):
+			index = SampleIndex(film=films[i], f=files[i])
+			index.fileIds[:] = i
+
+			# Audio pre-buffered past the end of the last film is dropped by
+			# the interleave as usual.
+			if i < len(films) - 1:
+				index = getJoinIndex(films[i], index)
+
+			indexes.append(index)
+
+		print("Joining " + str(len(films)) + " films")
+
+		vs = VidState(films[0], files[0], args.verbose, index=SampleIndex(indexes=indexes), files=files)
+		fixedFilm = Film(frameDesc=films[0].frameDesc, audioDesc=films[0].audioDesc, chunkTable=vs.getFixedChunkTable(createChunkPolicy(args)))
+
+		if args.patch_file != None:
+			writeFixedPatchFile(vs, fixedFilm, args)
+			return
+
+		seekIndex = writeFixedFilmFile(vs, fixedFilm, args.fixed_file, args, progress)
+	finally:
+		for f in files:
+			f.close()
+
+	wrapFixedFile(args, seekIndex, progress)
+
+def getDroppedFramesIndex(film, f, args):
+	index = SampleIndex(film=film, f=f)
+
+	if args.drop_window != None:
+		timescale = film.getTimescale()
+		windows = [(float(start) * timescale, float(end) * timescale) for (start, end) in args.drop_window]
+	else:
+		windows = None
+
+	dropIndex = getDropIndex(film, index, windows)
+	droppedFrames = int((~index.audio).sum() - (~dropIndex.audio).sum())
+	droppedBytes = int(index.sizes.sum() - dropIndex.sizes.sum())
+
+	print("Dropping " + str(droppedFrames) + " video frames, " + str(droppedBytes) + " bytes")
+
+	return dropIndex
+
+def getVideoClock(name):
+	if name.lower() == 'ntsc':
+		return JAG_NTSC_VIDEO_CLOCK
+	elif name.lower() == 'pal':
+		return JAG_PAL_VIDEO_CLOCK
+	else:
+		return int(name)
+
+def writeFanOut(index, f, variants, progress=None):
+	# Writes several fixed films planned from the same input film in one
+	# pass over the input.  Each sample is read once, in file order, and
+	# written straight to its place in every output.
+	#
+	# targets holds, for each variant, the offset in the output of every
+	# sample in the input index, or -1 if the variant drops it.
+	targets = numpy.full((len(variants), len(index)), -1, dtype=numpy.int64)
+	fds = []
+
+	try:
+		for (v, (vs, fixedFilm, fileName)) in enumerate(variants):
+			fd = os.open(fileName, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+			fds.append(fd)
+			os.ftruncate(fd, getFilmSize(fixedFilm))
+
+			header = io.BytesIO()
+			fixedFilm.writeHeader(header)
+			os.pwrite(fd, header.getvalue(), 0)
+
+			chunkRecs = fixedFilm.chunkTable.chunkRecords
+			for (cNum, chunk, positions) in vs.getFixedChunks(fixedFilm):
+				header = io.BytesIO()
+				chunk.writeHeader(header)
+				os.pwrite(fd, header.getvalue(), fixedFilm.getDataOffset() + chunkRecs[cNum].start)
+
+			(order, times) = vs.getFixedSampleOrder()
+			targets[v, order] = vs.getFixedSampleIndex(fixedFilm).offsets
+
+		readOrder = numpy.argsort(index.offsets, kind='stable')
+		readOrder = readOrder[(targets[:, readOrder] >= 0).any(axis=0)]
+
+		if progress != None:
+			progress.start("fan-out", totalBytes=int(index.sizes[readOrder].sum()), totalSamples=len(readOrder))
+
+		offsets = index.offsets.tolist()
+		sizes = index.sizes.tolist()
+
+		for i in readOrder.tolist():
+			f.seek(offsets[i], 0)
+			data = f.read(sizes[i])
+
+			for v in range(len(variants)):
+				target = int(targets[v, i])
+				if target >= 0:
+					os.pwrite(fds[v], data, target)
+
+			if progress != None:
+				progress.update(sizes[i], 1)
+
+		if progress != None:
+			progress.finish()
+	finally:
+		for fd in fds:
+			os.close(fd)
+
+def fanOutFilm(args):
+	progress = createProgress(args)
+
+	with open(args.input_file[0], "rb") as cpkIn:
+		film = Film(f=cpkIn)
+
+		printFilmInfo(film)
+
+		index = SampleIndex(film=film, f=cpkIn)
+		variants = []
+
+		for (clock, chunkDuration, fileName) in args.variant:
+			audioDesc = film.audioDesc
+			variantDesc = AudioDescription(channels=audioDesc.channels, bits=audioDesc.bits, compression=audioDesc.compression, signed=audioDesc.signed, sclk=audioDesc.sclk, driftRate=audioDesc.driftRate, videoClock=getVideoClock(clock))
+			variantFilm = Film(frameDesc=film.frameDesc, audioDesc=variantDesc, chunkTable=film.chunkTable, sampleTable=film.sampleTable)
+
+			if chunkDuration == '-':
+				chunkDuration = None
+			else:
+				chunkDuration = int(chunkDuration)
+			policy = ChunkPolicy(chunkDuration=chunkDuration, maxChunkSize=args.max_chunk_size, cdSpeed=args.cd_speed)
+
+			vs = VidState(variantFilm, cpkIn, args.verbose, index=index)
+			fixedFilm = getFixedFilm(variantFilm, vs, policy, args.to_chunky)
+
+			print("Planned " + fileName + ": " + str(variantDesc.videoClock) + " Hz video clock, " + str(variantDesc.sampleRate) + " Hz audio, " + str(len(fixedFilm.chunkTable.chunkRecords)) + " chunks")
+			variants.append((vs, fixedFilm, fileName))
+
+		print("Writing " + str(len(variants)) + " variants")
+		writeFanOut(index, cpkIn, variants, progress)
+
+def fixFilm(args):
+	progress = createProgress(args)
+
+	with open(args.input_file[0], "rb") as cpkIn:
+		if args.recover:
+			film = recoverFilm(cpkIn)
+		else:
+			film = Film(f=cpkIn)
+
+		printFilmInfo(film)
+
+		if film.isChunky():
+			vs = VidState(film, cpkIn)
+			vs.checkFilm()
+
+		if not film.isChunky() and args.to_chunky:
+			print("Converting Smooth film to a Chunky film")
+
+		print("Writing new film header")
+
+		index = None
+		if args.drop_frames or args.drop_window != None:
+			index = getDroppedFramesIndex(film, cpkIn, args)
+
+		audioSource = None
+		if args.resample_sclk != None:
+			if index == None:
+				index = SampleIndex(film=film, f=cpkIn)
+			(film, index, audioSource) = getResampledFilm(film, cpkIn, index, args.resample_sclk)
+
+		vs = VidState(film, cpkIn, args.verbose, index=index, audioSource=audioSource)
+
+		if args.optimize_preroll:
+			if not film.isChunky() and not args.to_chunky:
+				print("ERROR: Smooth films can't be fixed as Smooth films, use --to-chunky to convert them to Chunky films")
+				sys.exit(1)
+
+			audioLead = optimizeAudioLead(vs, createChunkPolicy(args), args)
+			if audioLead != None:
+				vs.setAudioLead(audioLead)
+
+		fixedFilm = getFixedFilm(film, vs, createChunkPolicy(args), args.to_chunky)
+
+		if args.drop_frames or args.drop_window != None:
+			rates = getChunkRates(fixedFilm.chunkTable)
+			if len(rates) > 0:
+				peak = int(numpy.argmax(rates))
+				print("Peak chunk rate: " + str(int(rates[peak])) + " bytes/s in chunk " + str(peak))
+
+		if args.patch_file != None:
+			writeFixedPatchFile(vs, fixedFilm, args)
+			return
+
+		seekIndex = writeFixedFilmFile(vs, fixedFilm, args.fixed_file, args, progress)
+
+	wrapFixedFile(args, seekIndex, progress)
+
+def main():
+	parser = ArgumentParser(description="Jaguar Cinepak Audio Fixer v" +
+				VERSION_STRING)
+	parser.add_argument('-o', '--fixed-file', type=str,
+			    help='Name of file to store the output in')
+	parser.add_argument('-a', '--fixed-aiff-file', type=str,
+			    help='Name of file to store the fixed cinepak data in with an AIFF wrapper.  If not specified, no AIFF file is generated')
+	parser.add_argument('-t', '--fixed-track-file', type=str,
+			    help='Name of a track file to store the fixed cinepak data in with an AIFF and track wrapper in.  If not specified, no track file is generated.')
+	parser.add_argument('-n', '--track-number', type=int,
+			    help='Track number to embed in the generated track file.  When writing an image file, the track number of the first film')
+	parser.add_argument('-N', '--image-track-number', type=int, action='append',
+			    help='Track number of a film in the image file.  Give it once per film, in the order of the input files.  Defaults to consecutive tracks starting at the -n track number')
+	parser.add_argument('-z', '--leading-zero-word', action='store_true',
+			    help='Write a dummy ZERO word at the start of the track file')
+	parser.add_argument('-i', '--image-file', type=str,
+			    help='Name of a BIN image file to store the fixed cinepak data of all the input films in, each wrapped in its own sector-aligned track.  A CUE sheet is written alongside it')
+	parser.add_argument('-c', '--cue-file', type=str,
+			    help='Name of the CUE sheet to write for the image file.  Defaults to the image file name with a .cue extension')
+	parser.add_argument('-S', '--scan', type=str, metavar='OUTPUT_DIR',
+			    help='Find the films in the input files, which may be AIFF, track or disc image files, and write each one fixed to OUTPUT_DIR')
+	parser.add_argument('-C', '--catalog', type=str, metavar='DATABASE',
+			    help='Record the films in the input files and directories in a SQLite catalog, scanning only files that are new or have changed since the last update')
+	parser.add_argument('-j', '--jobs', type=int,
+			    help='Number of films to process in parallel when writing an image file, scanning or cataloging.  Defaults to the number of CPUs')
+	parser.add_argument('-d', '--chunk-duration', type=int,
+			    help='Duration of video in each fixed chunk, in film timescale units.  Defaults to the chunk duration of the input film')
+	parser.add_argument('--max-chunk-size', type=int,
+			    help='Largest size of a fixed chunk in bytes.  Chunks are cut early, before their full duration, rather than grow past this size')
+	parser.add_argument('--cd-speed', type=int, choices=[1, 2],
+			    help='Speed of the CD drive the film will be played from.  Chunks are cut early rather than grow past what the drive reads in one chunk duration, and the peak sustained rate of the fixed film is reported')
+	parser.add_argument('-R', '--recover', action='store_true',
+			    help='Rebuild the chunk table of the input film from the chunks found in its data before fixing it, for films with a damaged chunk table')
+	parser.add_argument('-k', '--to-chunky', action='store_true',
+			    help='Convert Smooth input films to Chunky films, cutting chunks every --chunk-duration (one second by default)')
+	parser.add_argument('--drop-frames', action='store_true',
+			    help='Drop every video frame that is not a sync frame, showing the frame before it for longer instead')
+	parser.add_argument('--drop-window', nargs=2, action='append', metavar=('START', 'END'),
+			    help='Drop the video frames that are not sync frames from START to END seconds, and on up to the next sync frame.  May be given more than once')
+	parser.add_argument('--resample-sclk', type=lambda x: int(x, 0),
+			    help='Resample the audio to the sample rate of a different SCLK value, updating the audio description.  Higher values give lower sample rates and free up CD bandwidth')
+	parser.add_argument('--optimize-preroll', action='store_true',
+			    help='Put as little audio ahead of the video as playback from a drive at --cd-speed (2x by default) allows without the audio buffer running dry, so the first frame is shown sooner, and report the time saved')
+	parser.add_argument('-x', '--seek-index', type=str,
+			    help='Name of a file to store a seek index of the sync frames of the fixed film in')
+	parser.add_argument('-e', '--embed-seek-index', action='store_true',
+			    help='Store a seek index of the sync frames of the fixed film in the trailer padding of the AIFF wrapper, if it fits')
+	parser.add_argument('--clip', nargs=3, action='append', metavar=('START', 'END', 'CLIP_FILE'),
+			    help='Write the part of the input film from START to END seconds to CLIP_FILE as a fixed film, starting at the last sync frame before START.  May be given more than once')
+	parser.add_argument('--variant', nargs=3, action='append', metavar=('CLOCK', 'CHUNK_DURATION', 'FIXED_FILE'),
+			    help='Write a fixed film planned for a video clock of CLOCK (ntsc, pal or a rate in Hz) and chunks of CHUNK_DURATION timescale units (- for the default) to FIXED_FILE.  May be given more than once, and all variants are written in one pass over the input film')
+	parser.add_argument('-J', '--concat', action='store_true',
+			    help='Join all the input films, in order, into one fixed film.  The films must have matching frame and audio descriptions, and 8-bit mono audio')
+	parser.add_argument('-r', '--resume', action='store_true',
+			    help='Continue an interrupted fix from the last chunk recorded in the checkpoint journal kept next to the fixed file')
+	parser.add_argument('-P', '--patch-file', type=str,
+			    help='Name of a file to store a reorder patch in instead of the fixed film.  The patch only holds the new headers and where to copy each part of the fixed film from in the input films')
+	parser.add_argument('--apply-patch', type=str, metavar='PATCH_FILE',
+			    help='Rebuild the fixed film from the input films and a reorder patch, storing it in the file given by -o')
+	parser.add_argument('-w', '--extract-audio', type=str,
+			    help='Name of a file to write all the audio of the input film to, in stream order, instead of fixing it')
+	parser.add_argument('--audio-format', choices=['wav', 'raw'], default='wav',
+			    help='Format to write extracted audio in: a WAV file at the film sample rate, or the raw audio data as stored in the film.  Defaults to wav')
+	parser.add_argument('-s', '--simulate', action='store_true',
+			    help='Simulate playback of the input films from a CD drive at --cd-speed (2x by default) and report the audio buffer level, late frames and read stalls, instead of fixing them')
+	parser.add_argument('--audio-buffer-size', type=int,
+			    help='Size of the player audio buffer in bytes for --simulate.  Unlimited by default')
+	parser.add_argument('--video-buffer-size', type=int,
+			    help='Size of the player video read-ahead buffer in bytes for --simulate.  Unlimited by default')
+	parser.add_argument('-p', '--progress', choices=['bar', 'json'],
+			    help='Report progress with throughput and ETA, either as a terminal progress bar or as a stream of JSON objects, one per line')
+	parser.add_argument('--progress-file', type=str,
+			    help='Name of a file to append progress reports to.  Defaults to stderr')
+	parser.add_argument('-v', '--verbose', action='store_true',
+			    help='Print each chunk of the fixed chunk table as it is built')
+	parser.add_argument('input_file', metavar='INPUT_FILE', nargs='+',
+			    help='Chunk cinepak file')
+
+	args = parser.parse_args()
+
+	if args.simulate:
+		simulateFilms(args)
+		return
+
+	if args.image_file != None:
+		buildImage(args)
+		return
+
+	if args.scan != None:
+		scanFilms(args)
+		return
+
+	if args.catalog != None:
+		updateCatalog(args)
+		return
+
+	if args.extract_audio != None:
+		if len(args.input_file) != 1:
+			print("ERROR: Audio can only be extracted from one input file at a time")
+			sys.exit(1)
+
+		extractAudio(args)
+		return
+
+	if args.variant != None:
+		if len(args.input_file) != 1:
+			print("ERROR: Variants can only be written for one input file at a time")
+			sys.exit(1)
+
+		fanOutFilm(args)
+		return
+
+	if args.clip != None:
+		if len(args.input_file) != 1:
+			print("ERROR: Clips can only be extracted from one input file at a time")
+			sys.exit(1)
+
+		extractClips(args)
+		return
+
+	if args.fixed_file == None and args.patch_file == None:
+		print("ERROR: An output file must be specified with -o")
+		sys.exit(1)
+
+	if args.fixed_track_file != None:
+		if args.fixed_aiff_file == None:
+			print("ERROR: An AIFF file is required to generate a track file")
+			sys.exit(1)
+
+		if args.track_number == None:
+			print("ERROR: Track number must be specified when writing a track file")
+			sys.exit(1)
+
+	if args.apply_patch != None:
+		if args.fixed_file == None:
+			print("ERROR: An output file must be specified with -o")
+			sys.exit(1)
+
+		applyPatch(args)
+	elif args.concat:
+		concatFilms(args)
+	elif len(args.input_file) != 1:
+		print("ERROR: Only one input file can be fixed at a time without an image file or --concat")
+		sys.exit(1)
+	else:
+		fixFilm(args)
+
+if __name__ == '__main__':
+	main()
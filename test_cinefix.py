@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+import numpy
+
+import cinefix
+
+CINEFIX = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cinefix.py")
+
+def makeFilm(fileName, frameCount, seed, audioSkew=1.0, bits=8, stereo=0, chunkDuration=600, frameDuration=40, timescale=600, audioSize=1100):
+	# Writes a Chunky film whose audio is interleaved too early or too late
+	# by audioSkew, the way the broken encoder does it.  Video frames start
+	# with their frame number so they can be told apart.
+	rnd = random.Random(seed)
+	audioDesc = cinefix.AudioDescription(channels=stereo, bits=bits)
+	samples = []
+	audioTime = 0.0
+	videoTime = 0
+	frame = 0
+
+	while frame < frameCount:
+		if audioTime < videoTime + 1:
+			samples.append((bytes([(len(samples) * 7 + i) & 0xFF for i in range(audioSize)]), 0x7FFFFFFF, 0))
+			audioTime += (audioSize / audioDesc.sampleRate) * timescale * audioSkew
+		else:
+			data = cinefix.uintBytes(0xF0000000 | frame) + bytes(rnd.getrandbits(8) for i in range(rnd.randint(800, 6000)))
+			sync = 1 if frame % 12 == 0 else 0
+			samples.append((data, videoTime | sync << 31, frameDuration))
+			videoTime += frameDuration
+			frame += 1
+
+	chunks = []
+	chunkSamples = []
+	duration = 0
+	for sample in samples:
+		chunkSamples.append(sample)
+		duration += sample[2]
+		if duration >= chunkDuration:
+			chunks.append(chunkSamples)
+			chunkSamples = []
+			duration = 0
+
+	if len(chunkSamples) > 0:
+		chunks.append(chunkSamples)
+
+	chunkRecs = []
+	chunkData = []
+	start = 0
+	chunkTime = 0
+	syncPattern = 0x20202020
+	for chunkSamples in chunks:
+		sampleTable = io.BytesIO()
+		sampleTable.write(b'STAB')
+		sampleTable.write(cinefix.uintBytes(16 + 16 * len(chunkSamples)))
+		sampleTable.write(cinefix.uintBytes(timescale))
+		sampleTable.write(cinefix.uintBytes(len(chunkSamples)))
+
+		sampleStart = 0
+		for (data, time, duration) in chunkSamples:
+			cinefix.SampleRec(start=sampleStart, size=len(data), time=time & 0x7FFFFFFF, shadowSyncSample=time >> 31, duration=duration).write(sampleTable)
+			sampleStart += len(data)
+
+		data = cinefix.uintBytes(syncPattern) * 16 + sampleTable.getvalue() + b''.join([sample[0] for sample in chunkSamples])
+		chunkRecs.append(cinefix.ChunkRec(start=start, size=len(data), time=chunkTime, syncPattern=syncPattern))
+		chunkData.append(data)
+
+		start += len(data)
+		chunkTime += sum([sample[2] for sample in chunkSamples])
+		syncPattern += 0x01010101
+		if syncPattern >= 0x80808080:
+			syncPattern = 0x20202020
+
+	film = cinefix.Film(frameDesc=cinefix.FrameDescription(compressionType=b'cvid', width=160, height=120), audioDesc=audioDesc, chunkTable=cinefix.ChunkTable(timescale=timescale, chunkRecords=chunkRecs))
+
+	with open(fileName, "wb") as f:
+		film.writeHeader(f)
+		for data in chunkData:
+			f.write(data)
+
+def readFilm(fileName):
+	# Returns the data of the video frames and all the audio of a film
+	with open(fileName, "rb") as f, redirect_stdout(io.StringIO()):
+		film = cinefix.Film(f=f)
+		index = cinefix.SampleIndex(film=film, f=f)
+		frames = [index.getSample(f, i, readData=True).data for i in numpy.flatnonzero(~index.audio)]
+		audio = b''.join([index.getSample(f, i, readData=True).data for i in numpy.flatnonzero(index.audio)])
+
+	return (film, index, frames, audio)
+
+def runCinefix(*args):
+	return subprocess.run([sys.executable, CINEFIX] + list(args), stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+class FilmTestCase(unittest.TestCase):
+	def setUp(self):
+		self.tmpDir = tempfile.TemporaryDirectory()
+		self.addCleanup(self.tmpDir.cleanup)
+
+	def getPath(self, name):
+		return os.path.join(self.tmpDir.name, name)
+
+class ConcatTest(FilmTestCase):
+	def testJoinedFilmMatchesInputs(self):
+		# The first film is short of audio so it gets padded, the second has
+		# too much so it gets cut, and the last is left as it is.
+		inputFiles = [self.getPath("a.crg"), self.getPath("b.crg"), self.getPath("c.crg")]
+		makeFilm(inputFiles[0], 250, 1, audioSkew=1.1)
+		makeFilm(inputFiles[1], 250, 2, audioSkew=0.9)
+		makeFilm(inputFiles[2], 150, 3)
+
+		joinedFile = self.getPath("joined.crg")
+		result = runCinefix("-J", "-o", joinedFile, *inputFiles)
+		self.assertEqual(result.returncode, 0, result.stdout)
+
+		(joinedFilm, joinedIndex, joinedFrames, joinedAudio) = readFilm(joinedFile)
+
+		frame = 0
+		audioStart = 0
+		for i in range(len(inputFiles)):
+			(film, index, frames, audio) = readFilm(inputFiles[i])
+
+			self.assertEqual(joinedFrames[frame:frame + len(frames)], frames, inputFiles[i])
+			frame += len(frames)
+
+			if i < len(inputFiles) - 1:
+				# Each film's audio is cut or padded with silence to the
+				# length of its video.
+				videoSeconds = index.durations[~index.audio].sum() / float(film.getTimescale())
+				audioSize = int(videoSeconds * film.audioDesc.getBytesPerSecond())
+				expected = audio[:audioSize] + film.audioDesc.getSilence(audioSize - len(audio[:audioSize]))
+			else:
+				# Audio left over at the end of the last film may be dropped
+				audioSize = len(joinedAudio) - audioStart
+				expected = audio[:audioSize]
+
+			self.assertEqual(joinedAudio[audioStart:audioStart + audioSize], expected, inputFiles[i])
+			audioStart += audioSize
+
+		self.assertEqual(frame, len(joinedFrames))
+
+	def testJoinedPatchMatchesJoinedFilm(self):
+		inputFiles = [self.getPath("a.crg"), self.getPath("b.crg")]
+		makeFilm(inputFiles[0], 100, 1, audioSkew=1.1)
+		makeFilm(inputFiles[1], 100, 2)
+
+		joinedFile = self.getPath("joined.crg")
+		patchFile = self.getPath("joined.cpat")
+		patchedFile = self.getPath("patched.crg")
+		self.assertEqual(runCinefix("-J", "-o", joinedFile, *inputFiles).returncode, 0)
+		self.assertEqual(runCinefix("-J", "-P", patchFile, *inputFiles).returncode, 0)
+		self.assertEqual(runCinefix("--apply-patch", patchFile, "-o", patchedFile, *inputFiles).returncode, 0)
+
+		with open(joinedFile, "rb") as joined, open(patchedFile, "rb") as patched:
+			self.assertEqual(joined.read(), patched.read())
+
+	def testJoinRejectsWideAudio(self):
+		inputFiles = [self.getPath("a.crg"), self.getPath("b.crg")]
+		makeFilm(inputFiles[0], 50, 1, bits=16, stereo=1)
+		makeFilm(inputFiles[1], 50, 2, bits=16, stereo=1)
+
+		for output in (["-o", self.getPath("joined.crg")], ["-P", self.getPath("joined.cpat")]):
+			result = runCinefix("-J", *(output + inputFiles))
+			self.assertNotEqual(result.returncode, 0)
+			self.assertIn(b"only films with 8-bit mono audio can be", result.stdout)
+			self.assertFalse(os.path.exists(output[1]))
+
+class PatchTest(FilmTestCase):
+	def testPatchRejectsOtherFilmOfSameSize(self):
+		inputFile = self.getPath("a.crg")
+		otherFile = self.getPath("other.crg")
+		patchFile = self.getPath("a.cpat")
+		makeFilm(inputFile, 100, 1, audioSkew=1.1)
+		self.assertEqual(runCinefix("-P", patchFile, inputFile).returncode, 0)
+
+		# Same size, different frame height
+		with open(inputFile, "rb") as f:
+			data = bytearray(f.read())
+		data[28] ^= 0xFF
+		with open(otherFile, "wb") as f:
+			f.write(data)
+
+		result = runCinefix("--apply-patch", patchFile, "-o", self.getPath("patched.crg"), otherFile)
+		self.assertNotEqual(result.returncode, 0)
+		self.assertIn(b"is not the film this reorder patch was made from", result.stdout)
+		self.assertFalse(os.path.exists(self.getPath("patched.crg")))
+
+		result = runCinefix("--apply-patch", patchFile, "-o", self.getPath("patched.crg"), inputFile)
+		self.assertEqual(result.returncode, 0, result.stdout)
+
+class ScanTest(unittest.TestCase):
+	def testScanNamesAreUnique(self):
+		inputFiles = ["disc1/game.bin", "disc1/game.bin", "disc2/game.bin", "disc1/intro.crg"]
+		names = ["game-t01.crg", "game-t02.crg", "game-t01.crg", "intro-1.crg"]
+		self.assertEqual(cinefix.getUniqueScanNames(inputFiles, names), ["disc1-game-t01.crg", "game-t02.crg", "disc2-game-t01.crg", "intro-1.crg"])
+
+		# The same file given twice
+		inputFiles = ["disc1/game.bin", "disc1/game.bin"]
+		names = ["game-t01.crg", "game-t01.crg"]
+		self.assertEqual(cinefix.getUniqueScanNames(inputFiles, names), ["disc1-game-t01-1.crg", "disc1-game-t01-2.crg"])
+
+if __name__ == '__main__':
+	unittest.main()